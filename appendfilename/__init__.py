@@ -15,10 +15,24 @@ PROG_VERSION = u"Time-stamp: <2024-08-29 19:02:13 vk>"
 import re
 import sys
 import os
+import io
+import gc
+import stat
 import time
 import logging
+import itertools
+import operator
+import contextlib
+import functools
+import errno
+import csv
+import fnmatch
+import threading
+import collections
 from optparse import OptionParser
-import readline  # for raw_input() reading from stdin
+# modules only needed by the interactive mode (readline, hashlib, bisect,
+# json), by parallel runs (concurrent.futures) or by other options are
+# imported when needed so that non-interactive runs start faster
 
 PROG_VERSION_DATE = PROG_VERSION[13:23]
 INVOCATION_TIME = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime())
@@ -69,47 +83,175 @@ FILE_WITH_EXTENSION_TAGS_AND_EXT_INDEX = 2
 FILENAME_COMPONENT_REGEX = re.compile(r"[a-zA-Z]+")
 
 # blacklist of lowercase strings that are being ignored for tab completion
-FILENAME_COMPONENT_LOWERCASE_BLACKLIST = ['img', 'eine', 'einem', 'eines', 'fuer', 'haben',
-                                          'machen', 'macht', 'mein', 'meine', 'meinem',
-                                          'meinen', 'meines', 'neuem', 'neuer', 'neuen', 'vkvlc']
+FILENAME_COMPONENT_LOWERCASE_BLACKLIST = frozenset(['img', 'eine', 'einem', 'eines', 'fuer', 'haben',
+                                                    'machen', 'macht', 'mein', 'meine', 'meinem',
+                                                    'meinen', 'meines', 'neuem', 'neuer', 'neuen', 'vkvlc'])
 
 # initial CV with strings that are provided for tab completion in any case (whitelist)
 INITIAL_CONTROLLED_VOCABULARY = ['Karl', 'Graz', 'LaTeX', 'specialL', 'specialP']
 
 DEBUG_SEPARATOR = '★'
 
-parser = OptionParser(usage=USAGE)
+# all strings starting with a prefix are sorted between prefix and prefix + LARGEST_CHARACTER
+LARGEST_CHARACTER = chr(sys.maxunicode)
 
-parser.add_option("-t", "--text", dest="text",
-                  help="the text to add to the file name")
+# format of the VocabularyIndex files; increase on incompatible changes
+VOCABULARY_INDEX_VERSION = 2
+# the modification time of a directory is not changed by changes within this period
+VOCABULARY_INDEX_MTIME_GRANULARITY_NS = 2 * 10**9
 
-parser.add_option("-p", "--prepend", dest="prepend", action="store_true",
-                  help="do the opposite: instead of appending the text, prepend the text")
+# number of files per worker thread that are queued ahead with "--jobs"
+PARALLEL_WINDOW_PER_JOB = 16
 
-parser.add_option("--smart-prepend", dest="smartprepend", action="store_true",
-                  help="Like \"--prepend\" but do respect date/time-stamps: insert new text between \"YYYY-MM-DD(Thh.mm(.ss))\" and rest")
+# number of files whose new names are planned at once; a journal is synced once per group
+PLAN_GROUP_SIZE = 1000
 
-parser.add_option("--separator",
-                  metavar="separator",
-                  default=" ",
-                  help='override the defailt text separator which is "' + DEFAULT_TEXT_SEPARATOR + '"')
+# number of characters of "--output jsonl" records that are collected before writing them at once
+OUTPUT_BUFFER_SIZE = 64 * 1024
 
-parser.add_option("-d", "--dryrun", dest="dryrun", action="store_true",
-                  help="enable dryrun mode: just simulate what would happen, do not modify file(s)")
+# number of directories kept open for renaming files relative to them
+MAX_OPEN_DIRECTORIES = 64
+# number of directories whose names are kept for detecting conflicts when no pending rename refers to them
+MAX_TARGET_DIRECTORIES = 1024
+# a directory receiving this many renames of one group is read, so conflicts are found while planning
+READ_DIRECTORY_MIN_RENAMES = 100
+# O_PATH (Linux) does not require read permissions on the directory
+DIRECTORY_OPEN_FLAGS = getattr(os, 'O_PATH', os.O_RDONLY) | getattr(os, 'O_DIRECTORY', 0)
+# renameat2() (Linux) fails with this flag instead of replacing an existing file
+RENAME_NOREPLACE = 1
+# directory argument of the *at() functions (Linux) standing for the current directory
+AT_FDCWD = -100
 
-parser.add_option("-v", "--verbose", dest="verbose", action="store_true",
-                  help="enable verbose mode")
 
-parser.add_option("-q", "--quiet", dest="quiet", action="store_true",
-                  help="enable quiet mode")
+# modes of inserting the text into the file name
+MODE_APPEND = 'append'
+MODE_PREPEND = 'prepend'
+MODE_SMART_PREPEND = 'smart-prepend'
+MODES = (MODE_APPEND, MODE_PREPEND, MODE_SMART_PREPEND)
 
-parser.add_option("--version", dest="version", action="store_true",
-                  help="display version and exit")
+# what happens to a rename whose new name is already taken
+CONFLICT_SKIP = 'skip'
+CONFLICT_FAIL = 'fail'
+CONFLICT_SUFFIX = 'suffix'
+CONFLICT_POLICIES = (CONFLICT_SKIP, CONFLICT_FAIL, CONFLICT_SUFFIX)
+# with CONFLICT_SUFFIX, inserted before the tags and the extension of the new name
+CONFLICT_SUFFIX_FORMAT = ' (%i)'
 
-(options, args) = parser.parse_args()
 
+def build_option_parser():
+    """Returns the command line parser; parsing is left to the caller"""
 
-def handle_logging():
+    parser = OptionParser(usage=USAGE)
+
+    parser.add_option("-t", "--text", dest="text",
+                      help="the text to add to the file name")
+
+    parser.add_option("-p", "--prepend", dest="prepend", action="store_true",
+                      help="do the opposite: instead of appending the text, prepend the text")
+
+    parser.add_option("--smart-prepend", dest="smartprepend", action="store_true",
+                      help="Like \"--prepend\" but do respect date/time-stamps: insert new text between \"YYYY-MM-DD(Thh.mm(.ss))\" and rest")
+
+    parser.add_option("--separator",
+                      metavar="separator",
+                      default=" ",
+                      help='override the defailt text separator which is "' + DEFAULT_TEXT_SEPARATOR + '"')
+
+    parser.add_option("--files-from", dest="files_from", metavar="FILE",
+                      help="read the file names to process from FILE (one per line) or from stdin if FILE is \"-\"; " +
+                      "the list is processed while being read")
+
+    parser.add_option("-0", "--null", dest="null", action="store_true",
+                      help="file names of \"--files-from\" are separated by NUL characters instead of newlines " +
+                      "(e.g., \"find -print0\")")
+
+    parser.add_option("--map", dest="map", metavar="FILE",
+                      help="read file names with their own texts from FILE (or stdin if FILE is \"-\"): one row " +
+                      "per file with file name, text and optional mode (append, prepend or smart-prepend), " +
+                      "separated by tabs or commas; replaces \"--text\" and file name arguments")
+
+    parser.add_option("-r", "--recursive", dest="recursive", action="store_true",
+                      help="process all files within given directories and their sub-directories")
+
+    parser.add_option("--include", dest="include", action="append", metavar="PATTERN",
+                      help="with \"--recursive\": only process files whose name matches PATTERN (like \"*.jpg\"); " +
+                      "may be given multiple times")
+
+    parser.add_option("--exclude", dest="exclude", action="append", metavar="PATTERN",
+                      help="with \"--recursive\": skip files and directories whose name matches PATTERN; " +
+                      "may be given multiple times")
+
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=1, metavar="N",
+                      help="rename N files in parallel which speeds up network file systems; " +
+                      "renames of same file names are kept in order (default: 1)")
+
+    parser.add_option("--max-completions", dest="max_completions", type="int", metavar="N",
+                      help="offer only the N most frequent words of the file names for TAB completion")
+
+    parser.add_option("--ignore-case-completion", dest="ignore_case_completion", action="store_true",
+                      help="TAB completion does not distinguish between upper and lower case")
+
+    parser.add_option("--no-vocabulary-index", dest="no_vocabulary_index", action="store_true",
+                      help="do not store the words of file names for TAB completion in an index file " +
+                      "(in \"" + default_vocabulary_cache_directory() + "\")")
+
+    parser.add_option("--idempotent", dest="idempotent", action="store_true",
+                      help="skip files whose name already contains the text where it would be added, " +
+                      "so that repeated runs do not add the text twice")
+
+    parser.add_option("--on-conflict", dest="on_conflict", metavar="POLICY", type="choice",
+                      choices=CONFLICT_POLICIES, default=CONFLICT_FAIL,
+                      help="what to do if the new name of a file already exists or is the new name of another " +
+                      "file: \"fail\" (report an error, default), \"skip\" or \"suffix\" (add a number)")
+
+    parser.add_option("--output", dest="output", metavar="FORMAT", type="choice", choices=('log', 'jsonl'),
+                      default='log',
+                      help="\"jsonl\": write one JSON record per file to stdout with the keys old, new, status " +
+                      "(renamed, dryrun, skipped, failed), error and elapsed (seconds); default: \"log\"")
+
+    parser.add_option("--journal", dest="journal", metavar="FILE",
+                      help="record planned and completed renames in FILE so that an interrupted run can be " +
+                      "resumed or undone")
+
+    parser.add_option("--resume", dest="resume", action="store_true",
+                      help="with \"--journal\": skip files which were already renamed according to the journal")
+
+    parser.add_option("--undo", dest="undo", metavar="JOURNAL",
+                      help="revert all renames recorded in JOURNAL in reverse order")
+
+    parser.add_option("--serve", dest="serve", metavar="SOCKET",
+                      help="keep running and rename files on behalf of \"--connect\" clients via the Unix " +
+                      "domain socket SOCKET, which saves the start of a new process per run")
+
+    parser.add_option("--connect", dest="connect", metavar="SOCKET",
+                      help="let the server started with \"--serve SOCKET\" do the renames and offer the words " +
+                      "for TAB completion; this still starts a new process, so only programs which keep a " +
+                      "connection open get requests answered within a millisecond")
+
+    parser.add_option("--stats", dest="stats", action="store_true",
+                      help="print the time per phase, the time per file (p50, p99) and the number of system " +
+                      "calls per type to stderr at the end")
+
+    parser.add_option("--profile", dest="profile", metavar="FILE",
+                      help="write cProfile statistics of the renames to FILE (see the pstats module); " +
+                      "not with \"--jobs\" above 1 because cProfile only sees the main thread")
+
+    parser.add_option("-d", "--dryrun", dest="dryrun", action="store_true",
+                      help="enable dryrun mode: just simulate what would happen, do not modify file(s)")
+
+    parser.add_option("-v", "--verbose", dest="verbose", action="store_true",
+                      help="enable verbose mode")
+
+    parser.add_option("-q", "--quiet", dest="quiet", action="store_true",
+                      help="enable quiet mode")
+
+    parser.add_option("--version", dest="version", action="store_true",
+                      help="display version and exit")
+
+    return parser
+
+
+def handle_logging(options):
     """Log handling and configuration"""
 
     if options.verbose:
@@ -135,21 +277,58 @@ def error_exit(errorcode, text):
 class SimpleCompleter(object):
     # happily stolen from http://pymotw.com/2/readline/
 
-    def __init__(self, options):
-        self.options = sorted(options)
+    def __init__(self, options, frequencies=None, max_candidates=None, ignore_case=False):
+        """
+        @param options: iterable of words to complete
+        @param frequencies: optional dict of word -> number of occurrences; more frequent words are offered first
+        @param max_candidates: optional number of the most frequent words which are offered at all
+        @param ignore_case: boolean which defines if upper and lower case are treated the same when completing
+        """
+
+        options = list(options)
+        frequencies = frequencies or {}
+        # sorted() is stable, so words of equal frequency keep their order:
+        ranked = sorted(options, key=lambda word: -frequencies.get(word, 0))
+        if max_candidates:
+            ranked = ranked[:max_candidates]
+        self.rank = {word: rank for rank, word in enumerate(ranked)}
+        self.ranked = [word for word in self.rank if word]
+        self.ignore_case = ignore_case
+        if ignore_case:
+            keyed = sorted((word.casefold(), word) for word in self.ranked)
+            self.keys = [key for key, word in keyed]
+            self.options = [word for key, word in keyed]
+        else:
+            self.options = sorted(self.ranked)
+            self.keys = self.options
         return
 
+    def find_matches(self, text):
+        """
+        Searches the words starting with text by bisecting the sorted
+        words: O(log n + k) for n words and k matches.
+
+        @param text: beginning of a word
+        @param return: list of matching words in order of their rank
+        """
+
+        import bisect  # only needed for completing words interactively
+
+        if not text:
+            return self.ranked
+        prefix = text.casefold() if self.ignore_case else text
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + LARGEST_CHARACTER, start)
+        return sorted(self.options[start:end], key=self.rank.__getitem__)
+
     def complete(self, text, state):
         response = None
         if state == 0:
             # This is the first time for this text, so build a match list.
+            self.matches = self.find_matches(text)
             if text:
-                self.matches = [s
-                                for s in self.options
-                                if s and s.startswith(text)]
                 logging.debug('%s matches: %s', repr(text), self.matches)
             else:
-                self.matches = self.options[:]
                 logging.debug('(empty input) matches: %s', self.matches)
 
         # Return the state'th item from the match list,
@@ -163,27 +342,176 @@ class SimpleCompleter(object):
         return response
 
 
-def locate_and_parse_controlled_vocabulary():
+def extract_vocabulary_words(filename):
+    """
+    Returns the words of a file name which are offered for tab completion.
+
+    @param filename: file name without directory
+    @param return: list of words (strings), possibly with duplicates
+    """
+
+    # extract all words from the file name that don't contain numbers;
+    # skip words that are too small or listed in the blacklist:
+    return [item for item in FILENAME_COMPONENT_REGEX.findall(os.path.splitext(filename)[0])
+            if len(item) > 3 and item.lower() not in FILENAME_COMPONENT_LOWERCASE_BLACKLIST]
+
+
+def default_vocabulary_cache_directory():
+    """returns the directory of the VocabularyIndex files according to the platform's conventions"""
+
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser(os.path.join('~', 'AppData', 'Local'))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache'))
+    return os.path.join(base, 'appendfilename', 'vocabulary')
+
+
+class VocabularyIndex(object):
+    """
+    On-disk index of the words within the file names of one directory.
+
+    The index consists of two files: a small summary with the resulting
+    words and the modification time of the directory, and the list of
+    all file names with their inode and words. As long as the
+    modification time of the directory did not change, only the summary
+    is read. Otherwise, the directory is read again and only file names
+    which are new or got a different inode are split into words.
+    """
+
+    def __init__(self, directory='.', cachedir=None):
+        """
+        @param directory: directory whose file names are indexed
+        @param cachedir: directory of the index files; see default_vocabulary_cache_directory()
+        """
+
+        import hashlib
+
+        self.directory = os.path.abspath(directory)
+        cachedir = cachedir or default_vocabulary_cache_directory()
+        key = hashlib.sha1(os.fsencode(self.directory)).hexdigest()
+        self.summary_file = os.path.join(cachedir, key + '.json')
+        self.entries_file = os.path.join(cachedir, key + '.entries.json')
+        self.tokenized = 0  # number of file names split into words by the last update()
+
+    def word_counts(self):
+        """
+        @param return: collections.Counter of the words of the file names, see extract_vocabulary_words()
+        """
+
+        mtime_ns = os.stat(self.directory).st_mtime_ns
+        summary = self._load(self.summary_file)
+        if (summary.get('version') == VOCABULARY_INDEX_VERSION and
+                summary.get('directory') == self.directory and
+                'words' in summary and
+                summary.get('mtime_ns') == mtime_ns and
+                # changes right before the last scan might not have changed the mtime:
+                mtime_ns < summary.get('scanned_ns', 0) - VOCABULARY_INDEX_MTIME_GRANULARITY_NS):
+            logging.debug('vocabulary index of "%s" is up to date', self.directory)
+            return collections.Counter(summary['words'])
+        return self.update(mtime_ns)
+
+    def update(self, mtime_ns=None):
+        """
+        Reads the directory, updates the index files and returns the words.
+
+        @param mtime_ns: modification time of the directory before reading it
+        @param return: collections.Counter of the words of the file names
+        """
+
+        if mtime_ns is None:
+            mtime_ns = os.stat(self.directory).st_mtime_ns
+        scanned_ns = time.time_ns()
+        old_entries = self._load(self.entries_file).get('entries', {})
+        entries = {}
+        self.tokenized = 0
+
+        with os.scandir(self.directory) as scanner:
+            for entry in scanner:
+                try:
+                    if not entry.is_file():
+                        continue
+                    inode = entry.inode()
+                except OSError:
+                    continue
+                cached = old_entries.get(entry.name)
+                if cached and cached[0] == inode:
+                    words = cached[1]
+                else:
+                    words = extract_vocabulary_words(entry.name)
+                    self.tokenized += 1
+                entries[entry.name] = [inode, words]
+        logging.debug('vocabulary index of "%s": %i file names, %i new or changed',
+                      self.directory, len(entries), self.tokenized)
+
+        words = collections.Counter(itertools.chain.from_iterable(words for inode, words in entries.values()))
+        common = {'version': VOCABULARY_INDEX_VERSION, 'directory': self.directory}
+        # the summary is written last, so it never refers to outdated entries:
+        if self._save(self.entries_file, dict(common, entries=entries)):
+            self._save(self.summary_file, dict(common, mtime_ns=mtime_ns, scanned_ns=scanned_ns, words=words))
+        return words
+
+    def _load(self, filename):
+        import json  # only needed for the vocabulary index, journals and services
+
+        try:
+            with open(filename, encoding='utf-8', errors='surrogateescape') as indexfile:
+                return json.load(indexfile)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, filename, data):
+        """writes data to a temporary file which replaces filename afterwards; returns success"""
+
+        import json
+
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            temporaryfile = filename + '.' + str(os.getpid()) + '.tmp'
+            with open(temporaryfile, 'w', encoding='utf-8', errors='surrogateescape') as indexfile:
+                json.dump(data, indexfile, ensure_ascii=False, separators=(',', ':'))
+            os.replace(temporaryfile, filename)
+            return True
+        except OSError as error:
+            logging.debug('could not write vocabulary index "%s": %s', filename, error)
+            return False
+
+
+def count_controlled_vocabulary(directory='.', cachedir=None, use_index=True):
+    """
+    Counts the words of the file names in a directory in one pass.
+
+    @param directory: directory whose file names are parsed
+    @param cachedir: directory of the VocabularyIndex files
+    @param use_index: boolean which defines if the VocabularyIndex is used (True) or the directory is read without it (False)
+    @param return: collections.Counter of word -> number of occurrences; INITIAL_CONTROLLED_VOCABULARY comes first
+    """
+
+    cv = collections.Counter(dict.fromkeys(INITIAL_CONTROLLED_VOCABULARY, 0))
+    if use_index:
+        try:
+            cv.update(VocabularyIndex(directory, cachedir).word_counts())
+            return cv
+        except OSError as error:
+            logging.debug('could not use vocabulary index: %s', error)
+    with os.scandir(directory) as scanner:
+        for entry in scanner:
+            if entry.is_file():
+                cv.update(extract_vocabulary_words(entry.name))
+    return cv
+
+
+def locate_and_parse_controlled_vocabulary(directory='.', cachedir=None, use_index=True):
     """This method is looking for filenames in the current directory
     and parses them. This results in a list of words which are used for tab completion.
 
+    @param directory: directory whose file names are parsed
+    @param cachedir: directory of the VocabularyIndex files
+    @param use_index: boolean which defines if the VocabularyIndex is used (True) or the directory is read without it (False)
     @param return: either False or a list of found words (strings)
 
     """
 
-    cv = INITIAL_CONTROLLED_VOCABULARY
-    files = [f for f in os.listdir('.') if os.path.isfile(f)]
-    for f in files:
-        # extract all words from the file name that don't contain numbers
-        new_items = FILENAME_COMPONENT_REGEX.findall(os.path.splitext(os.path.basename(f))[0])
-        # remove words that are too small
-        new_items = [item for item in new_items if len(item) > 3]
-        # remove words that are listed in the blacklist
-        new_items = [item for item in new_items if item.lower() not in FILENAME_COMPONENT_LOWERCASE_BLACKLIST]
-        # remove words that are already in the controlled vocabulary
-        new_items = [item for item in new_items if item not in cv]
-        # append newly found words to the controlled vocabulary
-        cv.extend(new_items)
+    cv = list(count_controlled_vocabulary(directory, cachedir, use_index))
 
     if len(cv) > 0:
         return cv
@@ -191,190 +519,2699 @@ def locate_and_parse_controlled_vocabulary():
         return False
 
 
-def is_broken_link(name):
+class FileInfo(collections.namedtuple('FileInfo', ['is_link', 'is_file', 'is_dir', 'exists'])):
+    """
+    Type of a file name as determined by classify_file(). is_file,
+    is_dir and exists follow symbolic links, is_link does not.
+    """
+    __slots__ = ()
+
+
+MISSING_FILE_INFO = FileInfo(is_link=False, is_file=False, is_dir=False, exists=False)
+
+
+def classify_file(filename, directories=None, counter=None):
+    """
+    Determines the type of a file name with a single lstat() and, for
+    symbolic links only, one stat() of the link destination. The
+    result replaces the individual checks of os.path.isfile(),
+    os.path.isdir(), os.path.islink() and os.path.exists().
+
+    @param filename: an unicode string containing a file name
+    @param directories: optional DirectoryHandles for stat() relative to the directory
+    @param counter: optional ClassificationCounter which counts the system calls
+    @param return: FileInfo
+    """
+
+    if directories:
+        dirname, basename = os.path.split(filename)
+        stat_file = functools.partial(directories.stat, dirname, basename)
+    else:
+        stat_file = functools.partial(os.stat, filename)
+
+    syscalls = 1
+    try:
+        try:
+            mode = stat_file(follow_symlinks=False).st_mode
+        except (OSError, ValueError):
+            return MISSING_FILE_INFO
+
+        if not stat.S_ISLNK(mode):
+            return FileInfo(is_link=False, is_file=stat.S_ISREG(mode),
+                            is_dir=stat.S_ISDIR(mode), exists=True)
+
+        syscalls += 1
+        try:
+            mode = stat_file(follow_symlinks=True).st_mode
+        except (OSError, ValueError):
+            return FileInfo(is_link=True, is_file=False, is_dir=False, exists=False)
+        return FileInfo(is_link=True, is_file=stat.S_ISREG(mode),
+                        is_dir=stat.S_ISDIR(mode), exists=True)
+    finally:
+        if counter:
+            counter.add_syscalls(syscalls)
+
+
+def is_broken_link(name, info=None):
     """
     This function determines if the given name points to a file that is a broken link.
     It returns False for any other cases such as non existing files and so forth.
 
     @param name: an unicode string containing a file name
+    @param info: optional FileInfo of name as returned by classify_file()
     @param return: boolean
     """
 
-    if os.path.isfile(name) or os.path.isdir(name):
-        return False
-
-    try:
-        return not os.path.exists(os.readlink(name))
-    except FileNotFoundError:
-        return False
+    if info is None:
+        info = classify_file(name)
+    return info.is_link and not info.exists
 
 
-def is_nonbroken_symlink_file(filename):
+def is_nonbroken_symlink_file(filename, info=None):
     """
     Returns true if the filename is a non-broken symbolic link and not just an ordinary file. False, for any other case like no file at all.
 
     @param filename: an unicode string containing a file name
+    @param info: optional FileInfo of filename as returned by classify_file()
     @param return: bookean
     """
 
-    if os.path.isfile(filename):
-        if os.path.islink(filename):
-            return True
-    else:
-        return False
+    if info is None:
+        info = classify_file(filename)
+    return info.is_link and info.is_file
+
+
+def file_info_from_dir_entry(entry, counter=None):
+    """
+    Like classify_file() but re-uses the file type os.scandir() already
+    got from the directory, so there is no system call at all for
+    anything but symbolic links (on most file systems).
+
+    @param entry: os.DirEntry
+    @param counter: optional ClassificationCounter which counts the system calls
+    @param return: FileInfo
+    """
+
+    if not entry.is_symlink():
+        return FileInfo(is_link=False, is_file=entry.is_file(follow_symlinks=False),
+                        is_dir=entry.is_dir(follow_symlinks=False), exists=True)
+
+    if counter:
+        counter.add_syscalls(1)
+    try:
+        mode = entry.stat(follow_symlinks=True).st_mode
+    except OSError:
+        return FileInfo(is_link=True, is_file=False, is_dir=False, exists=False)
+    return FileInfo(is_link=True, is_file=stat.S_ISREG(mode), is_dir=stat.S_ISDIR(mode), exists=True)
+
+
+def legacy_classification_syscalls(info, symlink_source=False):
+    """
+    Returns the number of system calls the separate checks with
+    os.path.isfile() and friends needed for one file name before
+    classify_file() was introduced. Used for statistics only.
+
+    @param info: FileInfo of the file name
+    @param symlink_source: boolean which is True if only handle_file() checked the file (source of a symbolic link)
+    @param return: integer
+    """
+
+    if symlink_source:
+        # isdir, isfile
+        return 1 if info.is_dir else 2
+    if info.is_file:
+        # is_broken_link: isfile; is_nonbroken_symlink_file: isfile, islink; handle_file: isdir, isfile
+        return 5
+    if info.is_dir:
+        # is_broken_link: isfile, isdir; is_nonbroken_symlink_file: isfile; handle_file: isdir
+        return 4
+    if info.is_link:
+        # is_broken_link: isfile, isdir, readlink, exists
+        return 4
+    # is_broken_link: isfile, isdir, readlink; is_nonbroken_symlink_file: isfile; handle_file: isdir, isfile
+    return 6
+
+
+class ClassificationCounter(object):
+    """
+    Counts the system calls of classify_file() and the ones the
+    previous separate checks would have needed.
+    """
+
+    def __init__(self):
+        self.syscalls = 0
+        self.legacy_syscalls = 0
+        self.lock = threading.Lock()
+
+    def add_syscalls(self, syscalls):
+        with self.lock:
+            self.syscalls += syscalls
+
+    def add_legacy_syscalls(self, syscalls):
+        with self.lock:
+            self.legacy_syscalls += syscalls
+
+    @property
+    def saved(self):
+        return self.legacy_syscalls - self.syscalls
+
+
+class RunStats(object):
+    """
+    Collects the time spent per phase of a rename run, the time per file
+    and the number of system calls per type for --stats. With several
+    jobs, the times of the phases are summed over all threads.
+    """
+
+    PHASES = ('ingestion', 'planning', 'classification', 'symlinks', 'rename')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = collections.defaultdict(lambda: [0, 0.0])  # phase -> [count, seconds]
+        self.latencies = []  # seconds per file
+        self.syscalls = collections.Counter()
+        self.lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        """
+        @param phase: one of PHASES
+        @param seconds: time spent in phase once
+        """
+
+        with self.lock:
+            entry = self.phases[phase]
+            entry[0] += 1
+            entry[1] += seconds
+
+    def add_latency(self, seconds):
+        """
+        @param seconds: time spent on one file
+        """
+
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def count(self, syscall, number=1):
+        """
+        @param syscall: name of a system call like "stat" or "rename"
+        @param number: number of calls
+        """
+
+        with self.lock:
+            self.syscalls[syscall] += number
+
+    @staticmethod
+    def percentile(sorted_values, percent):
+        """
+        @param sorted_values: non-empty sorted list of numbers
+        @param percent: number between 0 and 100
+        @param return: value of the nearest rank
+        """
+
+        rank = max(1, -(-len(sorted_values) * percent // 100))  # rounded up
+        return sorted_values[int(rank) - 1]
+
+    def summary(self):
+        """
+        @param return: multi-line string with phases, latencies and system calls
+        """
+
+        lines = ['%i files in %.3fs' % (len(self.latencies), time.perf_counter() - self.start)]
+        for phase in self.PHASES:
+            count, seconds = self.phases.get(phase, (0, 0.0))
+            lines.append('  %-15s %10i times %10.3fs' % (phase, count, seconds))
+        if self.latencies:
+            latencies = sorted(self.latencies)
+            lines.append('  per file:       p50 %.3fms, p99 %.3fms, max %.3fms' % (
+                self.percentile(latencies, 50) * 1000, self.percentile(latencies, 99) * 1000, latencies[-1] * 1000))
+        lines.append('  system calls:   ' + (', '.join('%s %i' % item for item in sorted(self.syscalls.items()))
+                                             or 'none'))
+        return '\n'.join(lines)
 
 
 def get_link_source_file(filename):
     """
     Return a string representing the path to which the symbolic link points.
 
-    @param filename: an unicode string containing a file name
+    @param filename: an unicode string containing a file name of a symbolic link
     @param return: file path string
     """
 
-    assert(os.path.islink(filename))
     return os.readlink(filename)
 
 
-def handle_file_and_symlink_source_if_found(filename, text, dryrun):
+# numbers of the temporary links of replace_symlink(), unique within the process
+_temporary_link_numbers = itertools.count()
+
+
+def replace_symlink(link, target):
     """
-    Wraps handle_file() so that if the current filename is a symbolic link,
-    modify the source file and re-link its new name before handling the
-    current filename.
+    Points an existing symbolic link to a new target in one step: a
+    temporary symbolic link next to it is renamed over it, so the link
+    does not vanish in between. The temporary name does not contain the
+    name of the link, so it is short enough for every valid link name.
 
-    @param filename: string containing one file name
-    @param text: string that shall be added to file name(s)
-    @param dryrun: boolean which defines if files should be changed (False) or not (True)
-    @param return: number of errors and optional new filename
+    @param link: file name of the symbolic link
+    @param target: new target of the link, as it is written into the link
     """
 
-    num_errors = 0
+    temporary = os.path.join(os.path.dirname(link), '.afn-%i-%i-%i.tmp' % (
+        os.getpid(), threading.get_ident(), next(_temporary_link_numbers)))
+    os.symlink(target, temporary)
+    try:
+        os.replace(temporary, link)
+    except OSError:
+        os.remove(temporary)
+        raise
 
-    # if filename is a symbolic link and has same basename, tag the source file as well:
-    if RENAME_SYMLINK_ORIGINALS_WHEN_RENAMING_SYMLINKS and is_nonbroken_symlink_file(filename):
-        old_sourcefilename = get_link_source_file(filename)
 
-        if os.path.basename(old_sourcefilename) == os.path.basename(filename):
+def open_filename_list(path):
+    """
+    Opens a list of file names for reading. File names are decoded the
+    same way the operating system decodes command line arguments.
 
-            new_errors, new_sourcefilename = handle_file(old_sourcefilename, text, dryrun)
-            num_errors += new_errors
+    @param path: file name of the list or "-" for stdin
+    @param return: text stream
+    """
 
-            if old_sourcefilename != new_sourcefilename:
-                logging.info('Renaming the symlink-destination file of "' + filename + '" ("' +
-                             old_sourcefilename + '") as well …')
-                if options.dryrun:
-                    logging.debug('I would re-link the old sourcefilename "' + old_sourcefilename +
-                                  '" to the new one "' + new_sourcefilename + '"')
-                else:
-                    logging.debug('re-linking symlink "' + filename + '" from the old sourcefilename "' +
-                                  old_sourcefilename + '" to the new one "' + new_sourcefilename + '"')
-                    os.remove(filename)
-                    os.symlink(new_sourcefilename, filename)
-            else:
-                logging.debug('The old sourcefilename "' + old_sourcefilename + '" did not change. So therefore I don\'t re-link.')
+    encoding = sys.getfilesystemencoding()
+    if path == '-':
+        return io.TextIOWrapper(sys.stdin.buffer, encoding=encoding, errors='surrogateescape', newline='\n')
+    return open(path, encoding=encoding, errors='surrogateescape', newline='\n')
+
+
+def read_filenames(stream, nul_delimited=False, chunk_size=64 * 1024):
+    """
+    Generates the file names of a list one by one so that arbitrarily
+    long lists are processed without holding them in memory.
+
+    @param stream: text stream containing the file names
+    @param nul_delimited: boolean which defines if file names are separated by NUL (True) or newline (False)
+    @param chunk_size: number of characters read at once for NUL separated lists
+    @param return: generator of file names; empty entries are skipped
+    """
+
+    if not nul_delimited:
+        for line in stream:
+            name = line[:-1] if line.endswith('\n') else line
+            if name:
+                yield name
+        return
+
+    pending = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        names = (pending + chunk).split('\0')
+        pending = names.pop()
+        for name in names:
+            if name:
+                yield name
+    if pending:
+        yield pending
+
+
+def read_mapping(stream, onerror=None):
+    """
+    Generates the rows of a list of file names with their own texts one
+    by one, so that arbitrarily long lists are processed without holding
+    them in memory. Each row consists of a file name, the text and an
+    optional mode (one of MODES). Rows are separated by tabs if the
+    first line contains one and by commas otherwise; fields may be
+    quoted like in CSV files.
+
+    @param stream: text stream containing the rows
+    @param onerror: optional function which gets the line number and a description of an invalid row
+    @param return: generator of tuples of file name, text and mode or None; empty and invalid rows are skipped
+    """
+
+    lines = iter(stream)
+    first = next(lines, '')
+    reader = csv.reader(itertools.chain([first], lines), delimiter='\t' if '\t' in first else ',')
+    for row in reader:
+        if not row or row == ['']:
+            continue
+        if len(row) == 3 and not row[2]:
+            row.pop()
+        if len(row) not in (2, 3):
+            problem = 'expected file name, text and optional mode but got %i fields' % len(row)
+        elif not row[0]:
+            problem = 'no file name'
+        elif not row[1]:
+            problem = 'no text'
+        elif len(row) == 3 and row[2] not in MODES:
+            problem = 'unknown mode "%s"' % row[2]
         else:
-            logging.debug('The file "' + os.path.basename(filename) + '" is a symlink to "' + old_sourcefilename +
-                          '" but they two do have different basenames. Therefore I ignore the original file.')
+            yield row[0], row[1], row[2] if len(row) == 3 else None
+            continue
+        if onerror:
+            onerror(reader.line_num, problem)
 
-    # after handling potential symlink originals, I now handle the file we were talking about in the first place:
-    return handle_file(filename, text, dryrun)
 
+def matches_any(name, patterns):
+    """
+    @param name: file name without directory
+    @param patterns: list of shell-style wildcard patterns like "*.jpg"
+    @param return: True if name matches at least one pattern
+    """
+
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
 
-def handle_file(filename, text, dryrun):
+
+def walk_files(top, include=None, exclude=None, onerror=None):
     """
-    @param filename: one file name
-    @param text: string that shall be added to file name(s)
-    @param dryrun: boolean which defines if files should be changed (False) or not (True)
-    @param return: number of errors and optional new filename
-    """
-
-    assert(isinstance(filename, str))
-    num_errors = 0
-    new_filename = ''
-
-    if os.path.isdir(filename):
-        logging.warning("Skipping directory \"%s\" because this tool only processes file names." % filename)
-        num_errors += 1
-        return num_errors, False
-    elif not os.path.isfile(filename):
-        logging.error("Skipping \"%s\" because this tool only processes existing file names." % filename)
-        num_errors += 1
-        return num_errors, False
-
-    components = re.match(FILE_WITH_EXTENSION_REGEX, os.path.basename(filename))
-    if components:
-        old_basename = components.group(FILE_WITH_EXTENSION_BASENAME_INDEX)
-        tags_with_extension = components.group(FILE_WITH_EXTENSION_TAGS_AND_EXT_INDEX)
-    else:
-        logging.error('Could not extract file name components of \"%s\". Please do report.' % str(filename))
-        num_errors += 1
-        return num_errors, False
+    Generates the files below a directory and all of its
+    sub-directories without following symbolic links to directories.
+
+    Each directory is read by one os.scandir() and completely before its
+    files are generated: renaming files while the directory is still
+    being read might return renamed files a second time. Therefore, the
+    memory needed depends on the largest directory, not on the tree.
+
+    @param top: directory to start with
+    @param include: optional list of wildcard patterns; only files matching one of them are generated
+    @param exclude: optional list of wildcard patterns; matching files and directories are skipped
+    @param onerror: optional function which gets the OSError of a directory that could not be read
+    @param return: generator of os.DirEntry objects of files (including symbolic links to files) in alphabetical order
+    """
+
+    pending = [top]
+    while pending:
+        dirname = pending.pop()
+        try:
+            with os.scandir(dirname) as scanner:
+                entries = sorted(scanner, key=lambda entry: entry.name)
+        except OSError as error:
+            if onerror:
+                onerror(error)
+            continue
+
+        subdirectories = []
+        for entry in entries:
+            if exclude and matches_any(entry.name, exclude):
+                continue
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                is_dir = False
+            if is_dir:
+                subdirectories.append(entry.path)
+                continue
+            try:
+                # symbolic links to directories are neither followed nor handled as files:
+                if entry.is_symlink() and entry.is_dir():
+                    continue
+            except OSError:
+                pass
+            if not include or matches_any(entry.name, include):
+                yield entry
+        pending.extend(reversed(subdirectories))
+
+
+def expand_directories(filenames, include=None, exclude=None, onerror=None):
+    """
+    Replaces directories within file names by the files found below
+    them by walk_files().
+
+    @param filenames: iterable of file names
+    @param include: optional list of wildcard patterns for files found in directories
+    @param exclude: optional list of wildcard patterns for files and directories found in directories
+    @param onerror: optional function which gets the OSError of a directory that could not be read
+    @param return: generator of file names and os.DirEntry objects
+    """
+
+    for filename in filenames:
+        if os.path.isdir(filename):
+            yield from walk_files(filename, include, exclude, onerror)
+        else:
+            yield filename
+
+
+def is_word(text):
+    """
+    @param text: string
+    @param return: True if text is not empty and consists of characters matched by \\w only
+    """
+
+    # \w matches the characters of str.isalnum() and the underscore:
+    return text.isalnum() or (bool(text) and text.replace('_', 'a').isalnum())
+
 
+def split_file_name(basename):
+    """
+    Splits a file name into its name and its tags with extension, with
+    the same results as FILE_WITH_EXTENSION_REGEX but in linear time:
+    the name ends at the first FILENAME_TAG_SEPARATOR or, without
+    tags, at the last dot followed by word characters only.
+
+    @param basename: file name without its directory
+    @param return: tuple of name and tags with extension; None if there are no such components
+    """
+
+    if '\n' in basename:
+        # "." and "$" of the regular expression treat line breaks specially, so it is used for these rare names:
+        components = FILE_WITH_EXTENSION_REGEX.match(basename)
+        return components and components.group(FILE_WITH_EXTENSION_BASENAME_INDEX,
+                                               FILE_WITH_EXTENSION_TAGS_AND_EXT_INDEX)
+
+    split = basename.find(FILENAME_TAG_SEPARATOR)
+    if split < 0:
+        split = basename.rfind('.')
+        if split < 0 or not is_word(basename[split + 1:]):
+            split = len(basename)
+    return basename[:split], basename[split:]
+
+
+def split_positions(names, starts=None):
+    """
+    Like split_file_name() for many file names at once, with each step
+    done for all of them in a row by the string methods instead of one
+    function call per name.
+
+    @param names: list of file names without their directories
+    @param starts: optional list of the positions where the file names start within names, e.g., after a directory part
+    @param return: list of the positions where the names without tags and extension end; None for names with line breaks
+    """
+
+    if starts is None:
+        starts = [0] * len(names)
+    tags = list(map(str.find, names, itertools.repeat(FILENAME_TAG_SEPARATOR), starts))
+    dots = list(map(str.rfind, names, itertools.repeat('.')))
+    positions = [tag if tag >= 0 else
+                 dot if dot >= start and (extension.isalnum() or (extension != '' and extension.replace('_', 'a').isalnum()))
+                 else len(name)
+                 for name, start, tag, dot in zip(names, starts, tags, dots)
+                 for extension in [name[dot + 1:]]]
+    # one look for line breaks in all names is faster than one per name:
+    if '\n' in ''.join(names):
+        for index in [index for index, name in enumerate(names) if '\n' in name]:
+            positions[index] = None
+    return positions
+
+
+def split_timestamp(basename):
+    """
+    Splits a file name starting with a date or date-time stamp into the
+    stamp and the rest. Unlike FILE_WITH_EXTENSION_REGEX,
+    WITHTIME_AND_SECONDS_PATTERN has a fixed width up to the rest and
+    does not backtrack more than twice, so it is already linear and
+    faster than any parser in Python.
+
+    @param basename: file name without its directory
+    @param return: tuple of date/time-stamp and rest without the separator between them; None without stamp
+    """
+
+    match = WITHTIME_AND_SECONDS_PATTERN.match(basename)
+    return match and match.group(1, WITHTIME_AND_SECONDS_PATTERN.groups)
+
+
+@contextlib.contextmanager
+def paused_garbage_collection():
+    """
+    Pauses the cyclic garbage collector while millions of objects are
+    created in a row: they do not form any cycles, but each of them
+    brings the next collection closer and each full collection visits
+    all of them again.
+    """
+
+    enabled = gc.isenabled()
+    gc.disable()
     try:
-        if options.prepend:
-            logging.debug('options.prepend is set with ' + DEBUG_SEPARATOR + str(os.path.dirname(filename)) + DEBUG_SEPARATOR +
-                          str(text) + DEBUG_SEPARATOR + str(separator()) + DEBUG_SEPARATOR +
-                          str(old_basename) + DEBUG_SEPARATOR + str(tags_with_extension))
-            new_filename = os.path.join(os.path.dirname(filename), text + separator() + old_basename + tags_with_extension)
-        elif options.smartprepend:
-            match = re.match(WITHTIME_AND_SECONDS_PATTERN, filename)
-            logging.debug('options.smartprepend is set with ' + DEBUG_SEPARATOR + str(os.path.dirname(filename)) + DEBUG_SEPARATOR +
-                          str(text) + DEBUG_SEPARATOR + str(separator()) + DEBUG_SEPARATOR + str(old_basename) + DEBUG_SEPARATOR + str(tags_with_extension))
-            logging.debug('options.smartprepend is set with ' + DEBUG_SEPARATOR + str(type(os.path.dirname(filename))) + DEBUG_SEPARATOR +
-                          str(type(text)) + DEBUG_SEPARATOR + str(type(separator())) + DEBUG_SEPARATOR + str(type(old_basename)) + DEBUG_SEPARATOR + str(type(tags_with_extension)))
-            if not match:
-                logging.debug('can\'t find a date/time-stamp, doing a simple prepend')
-                new_filename = os.path.join(os.path.dirname(filename), text + separator() + old_basename + tags_with_extension)
-            else:
-                logging.debug('date/time-stamp found, insert text between date/time-stamp and rest')
-                logging.debug('options.smartprepend is set with ' + DEBUG_SEPARATOR + str(os.path.dirname(filename)) + DEBUG_SEPARATOR +
-                              str(match.group(1)) + DEBUG_SEPARATOR + str(match.group(len(match.groups()))) + DEBUG_SEPARATOR)
-                logging.debug('options.smartprepend is set with ' + DEBUG_SEPARATOR + str(type(os.path.dirname(filename))) + DEBUG_SEPARATOR +
-                              str(type(match.group(1))) + DEBUG_SEPARATOR + str(type(match.group(len(match.groups())))) + DEBUG_SEPARATOR)
-                new_filename = os.path.join(os.path.dirname(filename), match.group(1) + separator() + text + separator() + match.group(len(match.groups())))
-                logging.debug('new_filename is now: ' + new_filename)
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def plan_new_name(basename, text, mode=MODE_APPEND, separator=DEFAULT_TEXT_SEPARATOR):
+    """
+    Computes the new file name for a file name without any directory
+    part. This function does not access the file system and does not
+    depend on any command line option.
+
+    @param basename: file name without its directory
+    @param text: string that shall be added to the file name
+    @param mode: one of MODE_APPEND, MODE_PREPEND, MODE_SMART_PREPEND
+    @param separator: string between the old file name and the new text
+    @param return: new file name without its directory
+    """
+
+    if mode not in MODES:
+        raise ValueError('Unknown mode "%s"' % str(mode))
+
+    components = split_file_name(basename)
+    if not components:
+        raise ValueError('Could not extract file name components of "%s"' % str(basename))
+    old_basename, tags_with_extension = components
+
+    if mode == MODE_PREPEND:
+        logging.debug('prepend mode with %s%s%s%s%s%s%s%s', DEBUG_SEPARATOR,
+                      text, DEBUG_SEPARATOR, separator, DEBUG_SEPARATOR,
+                      old_basename, DEBUG_SEPARATOR, tags_with_extension)
+        return text + separator + old_basename + tags_with_extension
+    elif mode == MODE_SMART_PREPEND:
+        stamp = split_timestamp(basename)
+        # the types are looked up only if debug messages are enabled at all:
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        if debug:
+            logging.debug('smart-prepend mode with %s%s%s%s%s%s%s%s', DEBUG_SEPARATOR,
+                          text, DEBUG_SEPARATOR, separator, DEBUG_SEPARATOR, old_basename, DEBUG_SEPARATOR, tags_with_extension)
+            logging.debug('smart-prepend mode with %s%s%s%s%s%s%s%s', DEBUG_SEPARATOR,
+                          type(text), DEBUG_SEPARATOR, type(separator), DEBUG_SEPARATOR, type(old_basename), DEBUG_SEPARATOR, type(tags_with_extension))
+        if not stamp:
+            logging.debug('can\'t find a date/time-stamp, doing a simple prepend')
+            return text + separator + old_basename + tags_with_extension
         else:
-            new_filename = os.path.join(os.path.dirname(filename), old_basename + separator() + text + tags_with_extension)
-    except:
-        logging.error("Error while trying to build new filename: " + str(sys.exc_info()[0]))
-        num_errors += 1
-        return num_errors, False
-    assert(isinstance(new_filename, str))
-
-    if dryrun:
-        logging.info(" ")
-        logging.info(" renaming \"%s\"" % filename)
-        logging.info("      ⤷   \"%s\"" % (new_filename))
+            timestamp, rest = stamp
+            if debug:
+                logging.debug('date/time-stamp found, insert text between date/time-stamp and rest')
+                logging.debug('smart-prepend mode with %s%s%s%s%s', DEBUG_SEPARATOR,
+                              timestamp, DEBUG_SEPARATOR, rest, DEBUG_SEPARATOR)
+                logging.debug('smart-prepend mode with %s%s%s%s%s', DEBUG_SEPARATOR,
+                              type(timestamp), DEBUG_SEPARATOR, type(rest), DEBUG_SEPARATOR)
+            return timestamp + separator + text + separator + rest
     else:
-        logging.debug(" renaming \"%s\"" % filename)
-        logging.debug("      ⤷   \"%s\"" % (new_filename))
+        return old_basename + separator + text + tags_with_extension
+
+
+def contains_text(basename, text, mode=MODE_APPEND, separator=DEFAULT_TEXT_SEPARATOR):
+    """
+    Checks if a file name already contains the text at the position
+    where plan_new_name() would add it, i.e., if adding it again would
+    result in a duplicate like "name foo foo.txt". This function does
+    not access the file system.
+
+    @param basename: file name without its directory
+    @param text: string that shall be added to the file name
+    @param mode: one of MODE_APPEND, MODE_PREPEND, MODE_SMART_PREPEND
+    @param separator: string between the old file name and the new text
+    @param return: boolean
+    """
+
+    components = split_file_name(basename)
+    if not components:
+        return False
+    old_basename = components[0]
+
+    if mode == MODE_APPEND:
+        return old_basename.endswith(separator + text)
+    if mode == MODE_SMART_PREPEND:
+        stamp = split_timestamp(basename)
+        if stamp:
+            return stamp[1].startswith(text + separator)
+    return old_basename.startswith(text + separator)
+
+
+class RenamePlan(collections.namedtuple('RenamePlan', ['filename', 'new_filename', 'entry', 'conflict'],
+                                        defaults=(False,))):
+    """
+    Planned rename of one file as computed by plan_renames(). The
+    new_filename is None if the file name components could not be
+    extracted and equals filename if the file is skipped because it
+    already contains the text. The entry is the os.DirEntry the file
+    name was taken from (see walk_files()) or None. The conflict is
+    set by TargetNames.resolve() if new_filename is already taken.
+    """
+
+    __slots__ = ()
+
+    @property
+    def skipped(self):
+        return self.new_filename == self.filename
+
+    @property
+    def renames(self):
+        return self.new_filename is not None and self.new_filename != self.filename and not self.conflict
+
+
+# builds a RenamePlan from a tuple of all its fields without the keyword handling of RenamePlan():
+_new_rename_plan = functools.partial(tuple.__new__, RenamePlan)
+
+
+def split_filenames(filenames):
+    """
+    Splits file names into their directory parts (including the
+    trailing separator, so that directory part + basename is the file
+    name again) and their basenames.
+
+    @param filenames: list of file names
+    @param return: list of directory parts and list of basenames
+    """
+
+    if os.altsep is None:
+        sep = os.sep
+        positions = [filename.rfind(sep) + 1 for filename in filenames]
+        return ([filename[:position] for filename, position in zip(filenames, positions)],
+                [filename[position:] for filename, position in zip(filenames, positions)])
+    # drive letters and alternative separators are left to os.path:
+    parts = [os.path.split(filename) for filename in filenames]
+    return [os.path.join(head, '') if head else '' for head, tail in parts], [tail for head, tail in parts]
+
+
+def plan_renames(filenames, text, mode=MODE_APPEND, separator=DEFAULT_TEXT_SEPARATOR, idempotent=False):
+    """
+    Computes the new file names of many files at once, with the same
+    results as plan_new_name() and contains_text(). Instead of handling
+    one file after the other, each step is done for all file names in
+    a row without any logging. Like plan_new_name(), this
+    function does not access the file system.
+
+    @param filenames: iterable of file names or os.DirEntry objects
+    @param text: string that shall be added to the file names
+    @param mode: one of MODE_APPEND, MODE_PREPEND, MODE_SMART_PREPEND
+    @param separator: string between the old file name and the new text
+    @param idempotent: boolean which defines if files already containing the text are skipped (True) or not (False)
+    @param return: list of RenamePlan in the order of filenames
+    """
+
+    if mode not in MODES:
+        raise ValueError('Unknown mode "%s"' % str(mode))
+
+    filenames = list(filenames)
+    paths = list(map(os.fspath, filenames))
+    # os.fspath() returns file names given as str themselves, so only other objects may be os.DirEntry:
+    if all(map(operator.is_, filenames, paths)):
+        entries = itertools.repeat(None)
+    else:
+        entries = [filename if isinstance(filename, os.DirEntry) else None for filename in filenames]
+    with paused_garbage_collection():
+        if os.altsep is None:
+            # the names are planned within the whole file names, so that no directory parts have to be split off:
+            names = paths
+            starts = [position + 1 for position in map(str.rfind, paths, itertools.repeat(os.sep))]
+        else:
+            heads, names = split_filenames(paths)
+            starts = [0] * len(names)
+        prefix = text + separator
+        # prepending needs the positions of the tags and extensions only to look for the text:
+        positions = split_positions(names, starts) if mode == MODE_APPEND or idempotent else starts
+
+        # names with line breaks get wrong new names here and are planned again below:
+        if mode == MODE_APPEND:
+            infix = separator + text
+            if idempotent:
+                new_names = [name if name.endswith(infix, start, position) else
+                             name[:position] + infix + name[position:]
+                             for name, start, position in zip(names, starts, positions)]
+            else:
+                new_names = [name[:position] + infix + name[position:] for name, position in zip(names, positions)]
+        elif mode == MODE_PREPEND:
+            if idempotent:
+                new_names = [name if name.startswith(prefix, start, position) else
+                             name[:start] + prefix + name[start:]
+                             for name, start, position in zip(names, starts, positions)]
+            else:
+                new_names = [name[:start] + prefix + name[start:] for name, start in zip(names, starts)]
+        else:
+            # only names like "2021-..." may start with a date/time-stamp:
+            stamps = [split_timestamp(name[start:]) if name[start + 4:start + 5] == '-' else None
+                      for name, start in zip(names, starts)]
+            new_names = [(name if idempotent and stamp[1].startswith(prefix) else
+                          name[:start] + stamp[0] + separator + text + separator + stamp[1]) if stamp else
+                         name if idempotent and name.startswith(prefix, start, position) else
+                         name[:start] + prefix + name[start:]
+                         for name, start, position, stamp in zip(names, starts, positions, stamps)]
+
+        # names with line breaks are rare, so they are planned one by one:
+        if '\n' in ''.join(names):
+            for index in [index for index, name in enumerate(names) if '\n' in name]:
+                name, start = names[index], starts[index]
+                basename = name[start:]
+                if idempotent and contains_text(basename, text, mode, separator):
+                    new_names[index] = name
+                    continue
+                try:
+                    new_names[index] = name[:start] + plan_new_name(basename, text, mode, separator)
+                except ValueError:
+                    new_names[index] = None
+
+        if os.altsep is not None:
+            new_names = [head + new_name if new_name is not None else None for head, new_name in zip(heads, new_names)]
+        return list(map(_new_rename_plan, zip(paths, new_names, entries, itertools.repeat(False))))
+
+
+def suffixed_name(basename, *taken):
+    """
+    @param basename: file name without its directory
+    @param taken: sets of names which must not be returned
+    @param return: basename with the lowest number (see CONFLICT_SUFFIX_FORMAT) which is not taken
+    """
+
+    head, tail = split_file_name(basename) or (basename, '')
+    for number in itertools.count(2):
+        candidate = head + CONFLICT_SUFFIX_FORMAT % number + tail
+        if not any(candidate in names for names in taken):
+            return candidate
+
+
+class TargetNames(object):
+    """
+    Keeps track of the names which are taken in the directories of a
+    batch of renames, so conflicting renames are detected before any
+    file is renamed and without any stat() per file.
+
+    By default, only the new names of the batch are tracked: each
+    planned rename takes its new name, and new names which are taken
+    by other files are found by rename_noreplace() when the file is
+    renamed. Where the existing names are needed as well (numbered
+    names with CONFLICT_SUFFIX, dry runs, directories receiving at
+    least READ_DIRECTORY_MIN_RENAMES renames of a group, see read()),
+    a directory is read by one os.scandir() when it is first used;
+    afterwards each planned rename takes its new name and frees its
+    old name.
+
+    The names of a directory are kept as long as planned renames in it
+    are pending (see done()); of the other directories, only the
+    MAX_TARGET_DIRECTORIES most recently used ones are kept. So the
+    memory needed does not grow with the number of directories of a
+    run. Directories are never read while holding the lock, so a slow
+    directory does not delay other threads. An instance may be kept
+    for several runs, see settle().
+    """
+
+    def __init__(self, max_directories=MAX_TARGET_DIRECTORIES):
+        """
+        @param max_directories: number of directories without pending renames whose names are kept
+        """
+
+        self.max_directories = max_directories
+        # absolute directory name -> [set of names, number of pending renames,
+        #                             time of reading the directory or None if it was not read,
+        #                             False if the directory may have been changed by others since]
+        self.taken = collections.OrderedDict()
+        self.absolute = {}  # directory name as given -> absolute directory name
+        self.scanned = 0  # number of os.scandir() calls, for statistics
+        self.lock = threading.Lock()
+
+    def absolute_name(self, dirname):
+        """
+        @param dirname: directory name as part of a file name ('' for the current directory)
+        @param return: absolute directory name
+        """
+
+        absolute = self.absolute.get(dirname)
+        if absolute is None:
+            if len(self.absolute) >= 4 * self.max_directories:
+                self.absolute.clear()
+            absolute = self.absolute[dirname] = os.path.abspath(dirname or os.curdir)
+        return absolute
+
+    def scan(self, absolute):
+        """
+        @param absolute: absolute directory name
+        @param return: set of the names in the directory and the time before reading it
+        """
+
+        with self.lock:
+            self.scanned += 1
+        scanned_ns = time.time_ns()
+        try:
+            with os.scandir(absolute) as entries:
+                return {entry.name for entry in entries}, scanned_ns
+        except OSError:
+            return set(), scanned_ns  # the rename itself is going to report the problem
+
+    def unchanged(self, absolute, scanned_ns):
+        """
+        @param absolute: absolute directory name
+        @param scanned_ns: time before the directory was read
+        @param return: True if the directory was certainly not changed since it was read
+        """
+
+        try:
+            mtime_ns = os.stat(absolute).st_mtime_ns
+        except OSError:
+            return False
+        # changes right before reading might not have changed the mtime, see VocabularyIndex:
+        return mtime_ns < scanned_ns - VOCABULARY_INDEX_MTIME_GRANULARITY_NS
+
+    def read(self, dirname):
+        """
+        Reads the existing names of a directory which is not known yet.
+
+        @param dirname: directory name as part of a file name ('' for the current directory)
+        """
+
+        absolute = self.absolute_name(dirname)
+        if absolute in self.taken:
+            return
+        names, scanned_ns = self.scan(absolute)
+        with self.lock:
+            if absolute not in self.taken:
+                self.taken[absolute] = [names, 0, scanned_ns, True]
+                self._evict()
+
+    def resolve(self, plan, policy=CONFLICT_FAIL, scan=True, read_directory=False):
+        """
+        Takes the new name of a planned rename. If it is taken already,
+        the plan gets a conflict or, with CONFLICT_SUFFIX, a new name
+        with a number. Renames which take a new name have to be ended
+        by done().
+
+        @param plan: one RenamePlan
+        @param policy: one of CONFLICT_POLICIES
+        @param scan: boolean which defines if a directory which has to be read is read (True) or None is returned (False)
+        @param read_directory: boolean which defines if the existing names are needed even without CONFLICT_SUFFIX
+        @param return: RenamePlan or None
+        """
+
+        if not plan.renames:
+            return plan
+        plans = self._resolve([plan], policy, scan, read_directory)
+        return plans and plans[0]
+
+    def resolve_pair(self, plan, other, policy=CONFLICT_FAIL, read_directory=False):
+        """
+        Like resolve() for two renames in different directories which
+        have to get the same new basename, e.g., a symbolic link and its
+        source: either both get a conflict or both get a name which is
+        free in both directories.
+
+        @param plan: one RenamePlan
+        @param other: RenamePlan with the same new basename as plan
+        @param policy: one of CONFLICT_POLICIES
+        @param read_directory: boolean which defines if the existing names are needed even without CONFLICT_SUFFIX
+        @param return: tuple of both RenamePlan
+        """
+
+        return tuple(self._resolve([plan, other], policy, True, read_directory))
+
+    def _resolve(self, plans, policy, scan, read_directory):
+        """resolve() for renames sharing their new basename; returns a list of RenamePlan or None"""
+
+        read_directory = read_directory or policy == CONFLICT_SUFFIX
+        new_basename = os.path.basename(plans[0].new_filename)
+        dirnames = [os.path.dirname(plan.new_filename) for plan in plans]
+        absolutes = [self.absolute_name(dirname) for dirname in dirnames]
+        while True:
+            with self.lock:
+                entries = []
+                for absolute in absolutes:
+                    entry = self.taken.get(absolute)
+                    if entry is None and not read_directory:
+                        entry = self.taken[absolute] = [set(), 0, None, True]
+                    entries.append(entry)
+                unknown = [(absolute, entry) for absolute, entry in zip(absolutes, entries)
+                           if entry is None or not entry[3] or (entry[2] is None and read_directory)]
+                if not unknown:
+                    for absolute in absolutes:
+                        self.taken.move_to_end(absolute)
+                    taken = [entry[0] for entry in entries]
+                    if any(new_basename in names for names in taken):
+                        if policy != CONFLICT_SUFFIX:
+                            return [plan._replace(conflict=True) for plan in plans]
+                        new_basename = suffixed_name(new_basename, *taken)
+                    for plan, entry in zip(plans, entries):
+                        entry[0].add(new_basename)
+                        entry[0].discard(os.path.basename(plan.filename))
+                        entry[1] += 1
+                    self._evict()
+                    return [plan._replace(new_filename=os.path.join(dirname, new_basename))
+                            for plan, dirname in zip(plans, dirnames)]
+            if not scan:
+                return None
+            absolute, entry = unknown[0]
+            if entry is not None and not entry[3] and self.unchanged(absolute, entry[2]):
+                with self.lock:
+                    entry[3] = True
+                continue
+            names, scanned_ns = self.scan(absolute)
+            with self.lock:
+                entry = self.taken.get(absolute)
+                if entry is None or entry[1] == 0:
+                    self.taken[absolute] = [names, 0, scanned_ns, True]
+                else:
+                    # renames of another run are pending, whose new names are not in the directory yet:
+                    entry[0] |= names
+                    entry[2] = scanned_ns
+                    entry[3] = True
+
+    def release(self, filename, new_filename, old_exists=True):
+        """
+        Undoes the names taken and freed by resolve() for a rename
+        which is not done, e.g., because the file does not exist.
+
+        @param filename: file name of the rename
+        @param new_filename: new file name as resolved
+        @param old_exists: boolean which defines if filename still takes its name (True) or not (False)
+        """
+
+        dirname, new_basename = os.path.split(new_filename)
+        with self.lock:
+            entry = self.taken.get(self.absolute_name(dirname))
+            if entry is not None:
+                entry[0].discard(new_basename)
+                if old_exists:
+                    entry[0].add(os.path.basename(filename))
+
+    def done(self, plan):
+        """
+        Ends a rename taken by resolve(), whether it was done or not.
+
+        @param plan: RenamePlan as returned by resolve()
+        """
+
+        with self.lock:
+            entry = self.taken.get(self.absolute_name(os.path.dirname(plan.new_filename)))
+            if entry is not None:
+                entry[1] -= 1
+                self._evict()
+
+    def settle(self):
+        """
+        Prepares for the next run of a kept instance: other programs may
+        change the directories in between. Directories which were not
+        read are forgotten, the others are checked by their mtime when
+        they are used again.
+        """
+
+        with self.lock:
+            for absolute, entry in list(self.taken.items()):
+                if entry[1] == 0:
+                    if entry[2] is None:
+                        del self.taken[absolute]
+                    else:
+                        entry[3] = False
+
+    def _evict(self):
+        """forgets least recently used directories without pending renames above the limit; needs self.lock"""
+
+        surplus = len(self.taken) - self.max_directories
+        if surplus <= 0:
+            return
+        for absolute in [absolute for absolute, entry in self.taken.items() if entry[1] == 0][:surplus]:
+            del self.taken[absolute]
+
+
+class Renamer(object):
+    """
+    Holds the configuration of a rename run (mode, separator, dryrun) so
+    that files can be renamed without any global state. One instance
+    may be re-used for an arbitrary number of files and texts.
+    """
+
+    def __init__(self, mode=MODE_APPEND, separator=DEFAULT_TEXT_SEPARATOR, dryrun=False, jobs=1, journal=None,
+                 idempotent=False, on_conflict=CONFLICT_FAIL):
+        """
+        @param mode: one of MODE_APPEND, MODE_PREPEND, MODE_SMART_PREPEND
+        @param separator: string between the old file name and the new text
+        @param dryrun: boolean which defines if files should be changed (False) or not (True)
+        @param jobs: number of files which are handled in parallel
+        @param journal: optional Journal which records planned and completed renames
+        @param idempotent: boolean which defines if files already containing the text are skipped (True) or not (False)
+        @param on_conflict: one of CONFLICT_POLICIES for renames whose new name is already taken
+        """
+
+        if mode not in MODES:
+            raise ValueError('Unknown mode "%s"' % str(mode))
+        self.mode = mode
+        ## FIXXME: the user-provided separator is not checked at all: please do add some checks like removing '\n' and similar.
+        self.separator = separator if separator else DEFAULT_TEXT_SEPARATOR
+        self.dryrun = dryrun
+        if jobs < 1:
+            raise ValueError('Number of jobs has to be at least 1')
+        self.jobs = jobs
+        self.directories = None  # DirectoryHandles while rename_files() is running
+        self.counter = ClassificationCounter()
+        self.journal = journal
+        self.idempotent = idempotent
+        if on_conflict not in CONFLICT_POLICIES:
+            raise ValueError('Unknown conflict policy "%s"' % str(on_conflict))
+        self.on_conflict = on_conflict
+        self.targets = None  # TargetNames while rename_files() is running
+        self.kept_targets = None  # optional TargetNames which is kept for several runs, e.g., by RenameService
+        self.sources = None  # symlink source -> its new name, None or False for a conflict, while rename_files() is running
+        self.real_directories = {}  # directory of symbolic links -> os.path.realpath() of it
+        self.output = None  # optional JsonLinesWriter which gets one result per file
+        # class name of the last error of a thread (for self.output) and whether it was a conflict:
+        self.failures = threading.local()
+        self.stats = None  # optional RunStats which gets the phase times and system calls
+
+    def plan_new_name(self, basename, text):
+        """
+        @param basename: file name without its directory
+        @param text: string that shall be added to the file name
+        @param return: new file name without its directory
+        """
+
+        return plan_new_name(basename, text, self.mode, self.separator)
+
+    def plan(self, filenames, text):
+        """
+        Planning stage of rename_files(): computes all new file names
+        without accessing the file system, see plan_renames().
+
+        @param filenames: iterable of file names or os.DirEntry objects
+        @param text: string that shall be added to the file names
+        @param return: list of RenamePlan
+        """
+
+        return plan_renames(filenames, text, self.mode, self.separator, self.idempotent)
+
+    def plan_rows(self, rows):
+        """
+        Like plan() but each file has its own text and optionally its own
+        mode. Files with the same text and mode are planned together.
+
+        @param rows: iterable of tuples of file name, text and mode (None for self.mode), see read_mapping()
+        @param return: list of tuples of RenamePlan and text in the order of rows
+        """
+
+        rows = list(rows)
+        plans = [None] * len(rows)
+        groups = collections.defaultdict(list)  # (text, mode) -> indices of rows
+        for index, (filename, text, mode) in enumerate(rows):
+            groups[(text, mode or self.mode)].append(index)
+        for (text, mode), indices in groups.items():
+            group_plans = plan_renames([rows[index][0] for index in indices], text, mode, self.separator,
+                                       self.idempotent)
+            for index, plan in zip(indices, group_plans):
+                plans[index] = plan
+        return [(plan, row[1]) for plan, row in zip(plans, rows)]
+
+    def resolve_conflicts(self, plans):
+        """
+        Checks planned renames for new names which exist already or are
+        the new names of other files, see TargetNames.resolve(). The
+        names taken by earlier calls are kept while rename_files() is
+        running. Directories which receive at least
+        READ_DIRECTORY_MIN_RENAMES of the renames are read at once.
+
+        @param plans: list of RenamePlan as returned by plan()
+        @param return: list of RenamePlan
+        """
+
+        targets = self.targets or TargetNames()
+        renames_per_directory = collections.Counter(os.path.dirname(plan.new_filename)
+                                                    for plan in plans if plan.renames)
+        for dirname, renames in renames_per_directory.items():
+            if renames >= READ_DIRECTORY_MIN_RENAMES:
+                targets.read(dirname)
+        policy = self.on_conflict
+        return [targets.resolve(plan, policy, read_directory=self.dryrun) for plan in plans]
+
+    def skips(self, filename, text):
+        """
+        @param filename: one file name
+        @param text: string that shall be added to the file name
+        @param return: True if the file is skipped because of self.idempotent and its name already containing text
+        """
+
+        return self.idempotent and contains_text(os.path.basename(filename), text, self.mode, self.separator)
+
+    def classify(self, filename):
+        """
+        @param filename: one file name
+        @param return: FileInfo of filename, see classify_file()
+        """
+
+        return classify_file(filename, self.directories, self.counter)
+
+    def count(self, syscall, number=1):
+        """counts system calls in self.stats, if there is one; see RunStats.count()"""
+
+        if self.stats:
+            self.stats.count(syscall, number)
+
+    def source_key(self, filename, target):
+        """
+        @param filename: file name of a symbolic link
+        @param target: target of the link as returned by get_link_source_file()
+        @param return: absolute file name of the target which identifies it in self.sources
+        """
+
+        dirname = os.path.dirname(filename)
+        real_directory = self.real_directories.get(dirname)
+        if real_directory is None:
+            real_directory = self.real_directories[dirname] = os.path.realpath(dirname or os.curdir)
+        return os.path.normpath(os.path.join(real_directory, target))
+
+    def renamed_source(self, filename):
+        """
+        @param filename: file name of a symbolic link
+        @param return: True if the source of the link was renamed (or planned to in a dryrun) in this run
+        """
+
+        if not self.sources:
+            return False
+        try:
+            self.count('readlink')
+            return bool(self.sources.get(self.source_key(filename, get_link_source_file(filename))))
+        except OSError:
+            return False
+
+    def handle_file_and_symlink_source_if_found(self, filename, text, info=None, new_filename=None):
+        """
+        Wraps handle_file() so that if the current filename is a symbolic link,
+        modify the source file and re-link its new name before handling the
+        current filename.
+
+        While rename_files() is running, the new names of the sources
+        are remembered in self.sources, so that a source with many links
+        is renamed once and the other links are re-linked right away.
+        A link always gets the new basename of its source; if that is
+        taken in the directory of the link, the link is not renamed.
+
+        @param filename: string containing one file name
+        @param text: string that shall be added to file name(s)
+        @param info: optional FileInfo of filename as returned by classify()
+        @param new_filename: optional new file name as planned by plan()
+        @param return: number of errors and optional new filename
+        """
+
+        num_errors = 0
+        if info is None:
+            info = self.classify(filename)
+
+        # if filename is a symbolic link and has same basename, tag the source file as well:
+        start = time.perf_counter()
+        if RENAME_SYMLINK_ORIGINALS_WHEN_RENAMING_SYMLINKS and info.is_link and (
+                is_nonbroken_symlink_file(filename, info) or self.renamed_source(filename)):
+            self.count('readlink')
+            link_target = get_link_source_file(filename)
+            # relative targets are relative to the directory of the link:
+            old_sourcefilename = os.path.join(os.path.dirname(filename), link_target)
+
+            if os.path.basename(old_sourcefilename) == os.path.basename(filename):
+
+                key = self.source_key(filename, link_target) if self.sources is not None else None
+                renamed_source = False  # by this call
+                if key in (self.sources or {}):
+                    new_sourcefilename = self.sources[key]
+                    logging.debug('The source "%s" of "%s" was handled already.', old_sourcefilename, filename)
+                    if new_sourcefilename is False and new_filename:
+                        # the new name of the source was taken, so the link keeps its name as well:
+                        new_errors, new_filename = self.report_conflict(RenamePlan(
+                            old_sourcefilename, os.path.join(os.path.dirname(old_sourcefilename),
+                                                             os.path.basename(new_filename)), None, True))
+                        num_errors += new_errors
+                    elif new_sourcefilename and new_filename and self.targets and \
+                            os.path.basename(new_sourcefilename) != os.path.basename(new_filename):
+                        # the source got a number (CONFLICT_SUFFIX) for another link, this one follows:
+                        self.targets.release(filename, new_filename)
+                        linkplan = self.targets.resolve(
+                            RenamePlan(filename, os.path.join(os.path.dirname(filename),
+                                                              os.path.basename(new_sourcefilename)), None),
+                            read_directory=self.dryrun)
+                        if linkplan.conflict:
+                            new_errors, new_filename = self.report_conflict(linkplan)
+                            num_errors += new_errors
+                        else:
+                            self.targets.done(linkplan)
+                            new_filename = linkplan.new_filename
+                else:
+                    new_errors, new_sourcefilename, new_filename = self.handle_symlink_source(
+                        old_sourcefilename, text, new_filename, filename)
+                    num_errors += new_errors
+                    renamed_source = bool(new_sourcefilename) and new_sourcefilename != old_sourcefilename
+                    if key is not None and new_filename is False:
+                        self.sources[key] = False
+                    elif key is not None:
+                        self.sources[key] = (new_sourcefilename if new_sourcefilename and
+                                             new_sourcefilename != old_sourcefilename else None)
+
+                if new_sourcefilename and old_sourcefilename != new_sourcefilename:
+                    # the link keeps its form (relative or absolute) of the target:
+                    new_link_target = os.path.join(os.path.dirname(link_target), os.path.basename(new_sourcefilename))
+                    logging.info('Renaming the symlink-destination file of "%s" ("%s") as well …',
+                                 filename, old_sourcefilename)
+                    if self.dryrun:
+                        logging.debug('I would re-link the old sourcefilename "%s" to the new one "%s"',
+                                      link_target, new_link_target)
+                    else:
+                        logging.debug('re-linking symlink "%s" from the old sourcefilename "%s" to the new one "%s"',
+                                      filename, link_target, new_link_target)
+                        try:
+                            self.count('symlink')
+                            self.count('rename')
+                            replace_symlink(filename, new_link_target)
+                        except OSError as error:
+                            logging.error('Could not re-link "%s": %s', filename, error)
+                            if not self.recover_relink(filename, new_link_target, old_sourcefilename,
+                                                       new_sourcefilename if renamed_source else None, key):
+                                self.failures.error = type(error).__name__
+                                return num_errors + 1, False
+                        if self.journal:
+                            self.journal.relinked(filename, link_target, new_link_target)
+                        if not info.is_file:
+                            info = self.classify(filename)  # the link was broken before
+                else:
+                    logging.debug('The old sourcefilename "%s" did not change. So therefore I don\'t re-link.',
+                                  old_sourcefilename)
+            else:
+                logging.debug('The file "%s" is a symlink to "%s" but they two do have different basenames. '
+                              'Therefore I ignore the original file.', os.path.basename(filename), old_sourcefilename)
+
+        if self.stats and info.is_link:
+            # including the rename of the source file:
+            self.stats.add('symlinks', time.perf_counter() - start)
+
+        if new_filename is False:
+            return num_errors, False  # the link can not get the new basename of its source
+
+        # after handling potential symlink originals, I now handle the file we were talking about in the first place:
+        new_errors, new_filename = self.handle_file(filename, text, info, new_filename)
+        return num_errors + new_errors, new_filename
+
+    def recover_relink(self, filename, new_link_target, old_sourcefilename, new_sourcefilename, key):
+        """
+        Keeps a symbolic link valid after replace_symlink() failed: the
+        source renamed for this link is renamed back, so the link points
+        to it again. Sources renamed for other links before (or which
+        can not be renamed back) stay, and the link is removed and
+        created again with the new target instead.
+
+        @param filename: file name of the symbolic link
+        @param new_link_target: new target of the link
+        @param old_sourcefilename: file name of the source before it was renamed
+        @param new_sourcefilename: new file name of the source if it was renamed for this link, else None
+        @param key: key of the source in self.sources or None
+        @param return: True if the link points to new_link_target, False if it still points to the old source
+        """
+
+        if new_sourcefilename:
+            try:
+                self.count('rename')
+                rename_noreplace(new_sourcefilename, old_sourcefilename)
+            except OSError as error:
+                logging.error('Could not rename "%s" back: %s', new_sourcefilename, error)
+            else:
+                logging.info('Renamed "%s" back to "%s".', new_sourcefilename, old_sourcefilename)
+                if self.journal:
+                    self.journal.undone(('done', '', os.path.abspath(old_sourcefilename),
+                                         os.path.abspath(new_sourcefilename)))
+                if self.targets:
+                    self.targets.release(old_sourcefilename, new_sourcefilename)
+                if key is not None:
+                    self.sources[key] = None
+                return False
+
+        try:
+            self.count('symlink')
+            os.remove(filename)
+            os.symlink(new_link_target, filename)
+        except OSError as error:
+            logging.error('Could not create "%s" again: %s', filename, error)
+            return False
+        logging.info('Created "%s" again, pointing to "%s".', filename, new_link_target)
+        return True
+
+    def handle_symlink_source(self, sourcefilename, text, new_filename=None, link=None):
+        """
+        Renames the source file of a symbolic link with the same basename.
+        While rename_files() is running, the link and its source take
+        their new names together (see TargetNames.resolve_pair()), so
+        they keep their common basename with CONFLICT_SUFFIX as well.
+
+        @param sourcefilename: file name of the source
+        @param text: string that shall be added to file name(s)
+        @param new_filename: optional new file name of the link as planned by plan()
+        @param link: optional file name of the link, which has taken new_filename
+        @param return: number of errors, optional new file name of the source and new file name of the link (False if the link must not be renamed)
+        """
+
+        sourceinfo = self.classify(sourcefilename)
+        self.counter.add_legacy_syscalls(legacy_classification_syscalls(sourceinfo, symlink_source=True))
+        new_sourcefilename = None
+        if new_filename:
+            # the source has the same basename, so it gets the same new basename:
+            new_sourcefilename = os.path.join(os.path.dirname(sourcefilename), os.path.basename(new_filename))
+        else:
+            try:
+                new_sourcefilename = os.path.join(os.path.dirname(sourcefilename),
+                                                  self.plan_new_name(os.path.basename(sourcefilename), text))
+            except ValueError:
+                pass  # reported by handle_file()
+        sourceplan = RenamePlan(sourcefilename, new_sourcefilename, None)
+        if not sourceinfo.is_file or not self.targets:
+            return self._handle_symlink_source_file(sourceplan, text, sourceinfo, new_filename, link)
+        if link and new_filename and sourceplan.renames:
+            # the link gives up the name it has taken alone:
+            self.targets.release(link, new_filename)
+            sourceplan, linkplan = self.targets.resolve_pair(sourceplan, RenamePlan(link, new_filename, None),
+                                                             self.on_conflict, read_directory=self.dryrun)
+            if sourceplan.conflict:
+                return self.report_conflict(sourceplan) + (False,)
+            self.targets.done(linkplan)  # the link itself is still pending in apply_plan()
+            new_filename = linkplan.new_filename
+        else:
+            sourceplan = self.targets.resolve(sourceplan, self.on_conflict, read_directory=self.dryrun)
+            if sourceplan.conflict:
+                return self.report_conflict(sourceplan) + (False,)
+        try:
+            return self._handle_symlink_source_file(sourceplan, text, sourceinfo, new_filename, link)
+        finally:
+            if sourceplan.renames:
+                self.targets.done(sourceplan)
+
+    def _handle_symlink_source_file(self, sourceplan, text, sourceinfo, new_filename, link):
+        """handle_file() for the source of handle_symlink_source(); the link is not renamed on conflicts"""
+
+        self.failures.conflict = False
+        num_errors, new_sourcefilename = self.handle_file(sourceplan.filename, text, sourceinfo,
+                                                          sourceplan.new_filename)
+        if not self.failures.conflict:
+            return num_errors, new_sourcefilename, new_filename
+        if self.targets and link and new_filename:
+            self.targets.release(link, new_filename)
+        return num_errors, new_sourcefilename, False
+
+    def handle_file(self, filename, text, info=None, new_filename=None):
+        """
+        @param filename: one file name
+        @param text: string that shall be added to file name(s)
+        @param info: optional FileInfo of filename as returned by classify()
+        @param new_filename: optional new file name as planned by plan()
+        @param return: number of errors and optional new filename
+        """
+
+        assert(isinstance(filename, str))
+        num_errors = 0
+        if info is None:
+            info = self.classify(filename)
+
+        if info.is_dir:
+            logging.warning("Skipping directory \"%s\" because this tool only processes file names.", filename)
+            self.failures.error = 'IsADirectoryError'
+            num_errors += 1
+            return num_errors, False
+        elif not info.is_file:
+            logging.error("Skipping \"%s\" because this tool only processes existing file names.", filename)
+            self.failures.error = 'FileNotFoundError'
+            num_errors += 1
+            return num_errors, False
+        elif new_filename == filename or (new_filename is None and self.skips(filename, text)):
+            logging.info('Skipping "%s" because it already contains "%s".', filename, text)
+            return num_errors, filename
+
+        dirname, basename = os.path.split(filename)
         try:
-            os.rename(filename, new_filename)
+            if new_filename is None:
+                start = time.perf_counter()
+                new_filename = os.path.join(dirname, self.plan_new_name(basename, text))
+                if self.stats:
+                    self.stats.add('planning', time.perf_counter() - start)
+            new_basename = os.path.basename(new_filename)
+        except ValueError as e:
+            logging.error('%s. Please do report.', e)
+            self.failures.error = type(e).__name__
+            num_errors += 1
+            return num_errors, False
         except:
-            logging.error("Error while trying to rename file: " + str(sys.exc_info()))
+            logging.error("Error while trying to build new filename: %s", sys.exc_info()[0])
+            self.failures.error = sys.exc_info()[0].__name__
             num_errors += 1
             return num_errors, False
+        assert(isinstance(new_filename, str))
 
-    return num_errors, new_filename
+        if self.dryrun:
+            logging.info(" ")
+            logging.info(" renaming \"%s\"", filename)
+            logging.info("      ⤷   \"%s\"", new_filename)
+        else:
+            logging.debug(" renaming \"%s\"", filename)
+            logging.debug("      ⤷   \"%s\"", new_filename)
+            start = time.perf_counter()
+            try:
+                self.count('rename')
+                if self.directories:
+                    self.directories.rename(dirname, basename, new_basename)
+                else:
+                    rename_noreplace(filename, new_filename)
+            except FileExistsError:
+                # taken after the conflicts were checked, e.g., by another program:
+                return self.report_conflict(RenamePlan(filename, new_filename, None, True))
+            except:
+                logging.error("Error while trying to rename file: %s", sys.exc_info())
+                self.failures.error = sys.exc_info()[0].__name__
+                if self.targets:
+                    self.targets.release(filename, new_filename)
+                num_errors += 1
+                return num_errors, False
+            finally:
+                if self.stats:
+                    self.stats.add('rename', time.perf_counter() - start)
+            if self.journal:
+                self.journal.done(filename, new_filename)
+
+        return num_errors, new_filename
+
+    def apply_plan(self, plan, text):
+        """
+        Apply stage of rename_files(): does the file system work of one
+        RenamePlan as returned by plan() and resolve_conflicts().
+
+        @param plan: one RenamePlan
+        @param text: string that shall be added to the file name
+        @param return: number of errors and optional new filename
+        """
 
+        try:
+            return self._apply_plan(plan, text)
+        finally:
+            if self.targets and plan.renames:
+                self.targets.done(plan)
+
+    def _apply_plan(self, plan, text):
+        """apply_plan() without ending the rename in self.targets"""
+
+        filename = plan.filename
+        if plan.skipped:
+            # decided by the name only, so there is not even a stat():
+            logging.info('Skipping "%s" because it already contains "%s".', filename, text)
+            return 0, filename
+
+        start = time.perf_counter()
+        if plan.entry is not None:
+            info = file_info_from_dir_entry(plan.entry, self.counter)
+        else:
+            info = self.classify(filename)
+        if self.stats:
+            self.stats.add('classification', time.perf_counter() - start)
+        self.counter.add_legacy_syscalls(legacy_classification_syscalls(info))
 
-def separator():
-    """returns the separator between the previous file name and the new text"""
-    if options.separator:
-        ## FIXXME: the user-provided separator is not checked at all: please do add some checks like removing '\n' and similar.
-        return options.separator
+        if is_broken_link(filename, info) and not self.renamed_source(filename):
+            # skip broken links completely and write error message:
+            logging.error('File "%s" is a broken symbolic link. Skipping this one …', filename)
+            self.failures.error = 'FileNotFoundError'
+            if self.targets and plan.renames:
+                self.targets.release(filename, plan.new_filename)
+            return 1, False
+
+        if plan.new_filename is None and info.is_file:
+            logging.error('Could not extract file name components of "%s". Please do report.', filename)
+            self.failures.error = 'ValueError'
+            return 1, False
+
+        if plan.conflict and info.is_file:
+            # the new name may have been released by an earlier file which was not renamed:
+            retried = (self.targets.resolve(plan._replace(conflict=False), read_directory=self.dryrun)
+                       if self.targets else plan)
+            if retried.conflict:
+                return self.report_conflict(plan)
+            try:
+                if self.journal and not self.dryrun:
+                    self.journal.plan(filename, retried.new_filename)
+                    self.journal.sync()
+                return self.handle_file_and_symlink_source_if_found(filename, text, info, retried.new_filename)
+            finally:
+                self.targets.done(retried)
+
+        if self.targets and plan.renames and not info.is_file and not info.is_link:
+            # rejected by handle_file(), so it must not keep the new name:
+            self.targets.release(filename, plan.new_filename, info.exists)
+
+        # if filename is a symbolic link, tag the source file as well:
+        return self.handle_file_and_symlink_source_if_found(filename, text, info, plan.new_filename)
+
+    def report_conflict(self, plan):
+        """
+        Handles a RenamePlan with a conflict according to self.on_conflict.
+
+        @param plan: one RenamePlan
+        @param return: number of errors and optional new filename
+        """
+
+        self.failures.conflict = True
+        if self.on_conflict == CONFLICT_SKIP:
+            logging.info('Skipping "%s" because "%s" already exists or is the new name of another file.',
+                         plan.filename, plan.new_filename)
+            return 0, False
+        logging.error('Not renaming "%s" because "%s" already exists or is the new name of another file.',
+                      plan.filename, plan.new_filename)
+        self.failures.error = 'FileExistsError'
+        return 1, False
+
+    def rename_files(self, filenames, text):
+        """
+        Adds the text to all given file names, including the source
+        files of symbolic links with matching names. The new names are
+        planned for groups of files at once (see plan()) before their
+        files are renamed (see apply()). While running, the
+        directories of the files are kept open so that renames do not
+        have to resolve the full path again, and the names taken in
+        them are tracked for detecting conflicts (see TargetNames).
+        Therefore, one Renamer processes one batch at a time.
+
+        @param filenames: iterable of file names or os.DirEntry objects (see walk_files())
+        @param text: string that shall be added to file name(s)
+        @param return: number of errors
+        """
+
+        return self._run(filenames, lambda group: [(plan, text) for plan in self.plan(group, text)])
+
+    def rename_mapping(self, rows):
+        """
+        Like rename_files() but each file gets its own text and
+        optionally its own mode, e.g., from a list read by read_mapping().
+        The rows are processed while being read, in groups of
+        PLAN_GROUP_SIZE rows.
+
+        @param rows: iterable of tuples of file name, text and mode (None for self.mode)
+        @param return: number of errors
+        """
+
+        return self._run(rows, self.plan_rows)
+
+    def _run(self, items, plan_group):
+        """
+        Common part of rename_files() and rename_mapping(): keeps the
+        directories and target names of the run and applies the planned
+        renames.
+
+        @param items: iterable of file names or rows
+        @param plan_group: function returning a list of tuples of RenamePlan and text for a list of items
+        @param return: number of errors
+        """
+
+        self.directories = DirectoryHandles()
+        self.targets = self.kept_targets or TargetNames()
+        self.sources = {}
+        classification_syscalls = self.counter.syscalls
+        scanned = self.targets.scanned
+        try:
+            return self._apply(self._planned(items, plan_group))
+        finally:
+            self.count('stat', self.counter.syscalls - classification_syscalls)
+            self.count('scandir', self.targets.scanned - scanned)
+            self.count('open', self.directories.opened)
+            self.directories.close()
+            self.directories = None
+            self.targets.settle()
+            self.targets = None
+            self.sources = None
+            self.real_directories = {}
+
+    def _planned(self, items, plan_group):
+        """
+        Plans the renames in groups of PLAN_GROUP_SIZE files and checks
+        them for conflicts before any file of the group is renamed. With a
+        journal, the planned renames of a group are written and synced
+        at once before the first file of the group is handed out.
+
+        @param items: iterable of file names or rows
+        @param plan_group: function returning a list of tuples of RenamePlan and text for a list of items
+        @param return: generator of tuples of RenamePlan and text
+        """
+
+        items = iter(items)
+        while True:
+            start = time.perf_counter()
+            items_of_group = list(itertools.islice(items, PLAN_GROUP_SIZE))
+            if self.stats:
+                self.stats.add('ingestion', time.perf_counter() - start)
+            if not items_of_group:
+                return
+            start = time.perf_counter()
+            group = plan_group(items_of_group)
+            plans = self.resolve_conflicts([plan for plan, text in group])
+            if self.stats:
+                self.stats.add('planning', time.perf_counter() - start)
+            if self.journal and not self.dryrun:
+                for plan in plans:
+                    if plan.renames:
+                        self.journal.plan(plan.filename, plan.new_filename)
+                self.journal.sync()
+            yield from zip(plans, [text for plan, text in group])
+
+    def apply(self, plans, text):
+        """
+        Apply stage of rename_files(): does the file system work of
+        the given RenamePlan objects, see apply_plan().
+
+        @param plans: iterable of RenamePlan as returned by plan()
+        @param text: string that shall be added to file name(s)
+        @param return: number of errors
+        """
+
+        return self._apply((plan, text) for plan in plans)
+
+    def _apply(self, tasks):
+        """
+        @param tasks: iterable of tuples of RenamePlan and the text of its file
+        @param return: number of errors
+        """
+
+        if self.jobs > 1:
+            return self._rename_files_in_parallel(tasks)
+
+        num_errors = 0
+        for plan, text in tasks:
+            new_errors, result = self.apply_plan_with_result(plan, text)
+            num_errors += new_errors
+            if result:
+                self.output.write(result)
+
+        return num_errors
+
+    def apply_plan_with_result(self, plan, text, with_result=False):
+        """
+        Like apply_plan() but with a record of the result for
+        self.output, if there is one, and the time per file for
+        self.stats.
+
+        @param plan: one RenamePlan
+        @param text: string that shall be added to the file name
+        @param with_result: boolean which defines if the record is returned even without self.output (True) or not (False)
+        @param return: number of errors and dict with the keys old, new, status, error, elapsed or None
+        """
+
+        if not self.output and not self.stats and not with_result:
+            return self.apply_plan(plan, text)[0], None
+
+        self.failures.error = None
+        self.failures.conflict = False
+        start = time.perf_counter()
+        num_errors, new_filename = self.apply_plan(plan, text)
+        elapsed = time.perf_counter() - start
+        if self.stats:
+            self.stats.add_latency(elapsed)
+        if not self.output and not with_result:
+            return num_errors, None
+        error = None
+        if num_errors:
+            status = 'failed'
+            error = self.failures.error
+        elif not new_filename or new_filename == plan.filename:
+            status = 'skipped'
+            if self.failures.conflict:
+                error = 'FileExistsError'
+        else:
+            status = 'dryrun' if self.dryrun else 'renamed'
+        # the planned new name of a file which was not renamed may be the name of another file:
+        return num_errors, {'old': plan.filename, 'new': new_filename if status in ('dryrun', 'renamed') else None,
+                            'status': status, 'error': error, 'elapsed': round(elapsed, 6)}
+
+    def undo(self, journal_filename):
+        """
+        Reverts the completed renames and re-links of a journal in
+        reverse order. Reverted entries are recorded in the journal as
+        well, so an interrupted undo may simply be started again.
+
+        @param journal_filename: file name of a journal written by Journal
+        @param return: number of errors
+        """
+
+        records = []
+        undone = set()
+        for record in Journal.read(journal_filename):
+            if record['op'] == 'undone':
+                undone.add(tuple(record['entry']))
+            elif record['op'] in ('done', 'relinked'):
+                records.append(record)
+
+        num_errors = 0
+        self.directories = DirectoryHandles()
+        try:
+            for record in reversed(records):
+                num_errors += self._undo_record(record, undone)
+        finally:
+            self.directories.close()
+            self.directories = None
+        return num_errors
+
+    def _undo_record(self, record, undone):
+        """
+        @param record: done or relinked record of a journal
+        @param undone: set of entries which were already reverted
+        @param return: number of errors
+        """
+
+        entry = Journal.entry(record)
+        if entry in undone:
+            return 0
+        if record['op'] == 'done':
+            logging.info(" renaming \"%s\"", record['new'])
+            logging.info("      ⤷   \"%s\"", record['old'])
+        else:
+            logging.info(" re-linking \"%s\" to \"%s\"", record['link'], record['old'])
+        if self.dryrun:
+            return 0
+
+        try:
+            if record['op'] == 'done':
+                dirname, new_basename = os.path.split(record['new'])
+                self.directories.rename(dirname, new_basename, os.path.basename(record['old']))
+            else:
+                replace_symlink(record['link'], record['old'])
+        except OSError as error:
+            logging.error('Could not undo: %s', error)
+            return 1
+        if self.journal:
+            self.journal.undone(entry)
+        return 0
+
+    @staticmethod
+    def ordering_keys(plan):
+        """
+        Returns the names a rename may read or write: the basename and
+        the new basename of the file. Symbolic link sources are only
+        renamed if they share the basename of the link, so they are
+        covered as well. Renames with common keys must not be reordered.
+
+        @param plan: one RenamePlan
+        @param return: set of basenames
+        """
+
+        keys = {os.path.basename(plan.filename)}
+        if plan.new_filename is not None:
+            keys.add(os.path.basename(plan.new_filename))
+        return keys
+
+    def _rename_files_in_parallel(self, tasks):
+        """
+        Like _apply() but with self.jobs worker threads. Renames
+        sharing ordering keys are run in input order, log messages are
+        emitted in input order as well.
+
+        @param tasks: iterable of tuples of RenamePlan and the text of its file
+        @param return: number of errors
+        """
+
+        import concurrent.futures  # only needed for --jobs above 1
+
+        num_errors = 0
+        window = collections.deque()  # (future, keys) in input order
+        last_future_of_key = {}
+        logbuffer = _ThreadLogBuffer()
+
+        def finish_oldest():
+            future, keys = window.popleft()
+            new_errors, result, records = future.result()
+            for record in records:
+                logging.getLogger().handle(record)
+            if result:
+                self.output.write(result)
+            for key in keys:
+                if last_future_of_key.get(key) is future:
+                    del last_future_of_key[key]
+            return new_errors
+
+        logging.getLogger().addFilter(logbuffer)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                for plan, text in tasks:
+                    keys = self.ordering_keys(plan)
+                    predecessors = {last_future_of_key[key] for key in keys if key in last_future_of_key}
+                    future = executor.submit(self._rename_file_after, predecessors, plan, text, logbuffer)
+                    for key in keys:
+                        last_future_of_key[key] = future
+                    window.append((future, keys))
+                    if len(window) >= PARALLEL_WINDOW_PER_JOB * self.jobs:
+                        num_errors += finish_oldest()
+                while window:
+                    num_errors += finish_oldest()
+        finally:
+            logging.getLogger().removeFilter(logbuffer)
+
+        return num_errors
+
+    def _rename_file_after(self, predecessors, plan, text, logbuffer, with_result=False):
+        """
+        Worker of _rename_files_in_parallel() and rename_many(): waits
+        for the renames which have to happen before and collects the log
+        records.
+
+        Waiting does not dead-lock because the executor starts its
+        tasks in submission order, so all predecessors are already
+        running or finished.
+
+        @param predecessors: set of futures to wait for
+        @param with_result: boolean which defines if the result record is returned even without self.output
+        @param return: number of errors, result record (see apply_plan_with_result()) and list of log records
+        """
+
+        import concurrent.futures
+
+        concurrent.futures.wait(predecessors)
+        logbuffer.start()
+        try:
+            num_errors, result = self.apply_plan_with_result(plan, text, with_result)
+        finally:
+            records = logbuffer.stop()
+        return num_errors, result, records
+
+    async def rename_many(self, paths, text):
+        """
+        Asynchronous counterpart of rename_files() for programs using
+        asyncio: all file system calls, including the ones for planning
+        and for detecting conflicts, are done by up to self.jobs worker
+        threads, so the event loop is never blocked by a slow file
+        system. Paths are only taken from the (asynchronous) iterator
+        while fewer than PARALLEL_WINDOW_PER_JOB * self.jobs files are
+        in progress. Renames sharing ordering keys are run in input
+        order; their log messages are emitted per file when it is done.
+
+        A journal is not supported.
+
+        @param paths: asynchronous iterator or iterable of file names or os.DirEntry objects
+        @param text: string that shall be added to file name(s)
+        @param return: asynchronous generator of result records (see apply_plan_with_result()) in order of completion
+        """
+
+        import asyncio  # only needed by programs using asyncio
+        import concurrent.futures
+
+        if self.journal:
+            raise ValueError('rename_many() does not support a journal')
+
+        loop = asyncio.get_running_loop()
+        window = PARALLEL_WINDOW_PER_JOB * self.jobs
+        pending = {}  # asyncio future -> (future of the executor, ordering keys)
+        last_future_of_key = {}
+        logbuffer = _ThreadLogBuffer()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs)
+        self.directories = DirectoryHandles()
+        self.targets = TargetNames()
+        self.sources = {}
+        logging.getLogger().addFilter(logbuffer)
+        try:
+            async for path in iterate_async(paths):
+                plan = self.plan([path], text)[0]
+                resolved = self.targets.resolve(plan, self.on_conflict, scan=False, read_directory=self.dryrun)
+                if resolved is None:
+                    # the directory has to be read first, which must not block the event loop:
+                    resolved = await loop.run_in_executor(executor, functools.partial(
+                        self.targets.resolve, plan, self.on_conflict, read_directory=self.dryrun))
+                plan = resolved
+
+                keys = self.ordering_keys(plan)
+                predecessors = {last_future_of_key[key] for key in keys if key in last_future_of_key}
+                future = executor.submit(self._rename_file_after, predecessors, plan, text, logbuffer, True)
+                for key in keys:
+                    last_future_of_key[key] = future
+                pending[asyncio.wrap_future(future)] = (future, keys)
+
+                while len(pending) >= window:
+                    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for result in self._finish(done, pending, last_future_of_key):
+                        yield result
+
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for result in self._finish(done, pending, last_future_of_key):
+                    yield result
+        finally:
+            # renames which did not start yet are dropped when the caller stops early:
+            for future, keys in pending.values():
+                future.cancel()
+            await loop.run_in_executor(None, executor.shutdown)
+            logging.getLogger().removeFilter(logbuffer)
+            self.directories.close()
+            self.directories = None
+            self.targets = None
+            self.sources = None
+            self.real_directories = {}
+
+    def _finish(self, done, pending, last_future_of_key):
+        """
+        Part of rename_many(): emits the log records of completed renames.
+
+        @param done: set of asyncio futures which are done
+        @param pending: dict of asyncio future -> (future of the executor, ordering keys); done ones are removed
+        @param last_future_of_key: dict of ordering key -> last future using it; done ones are removed
+        @param return: list of result records
+        """
+
+        results = []
+        for done_future in done:
+            future, keys = pending.pop(done_future)
+            for key in keys:
+                if last_future_of_key.get(key) is future:
+                    del last_future_of_key[key]
+            num_errors, result, records = done_future.result()
+            for record in records:
+                logging.getLogger().handle(record)
+            if self.output:
+                self.output.write(result)
+            results.append(result)
+        return results
+
+
+async def iterate_async(items):
+    """
+    @param items: asynchronous iterator or iterable
+    @param return: asynchronous generator of the items
+    """
+
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield item
     else:
-        return DEFAULT_TEXT_SEPARATOR
+        for item in items:
+            yield item
+
+
+def rename_many(paths, text, mode=MODE_APPEND, separator=DEFAULT_TEXT_SEPARATOR, dryrun=False, jobs=1,
+                idempotent=False, on_conflict=CONFLICT_FAIL):
+    """
+    Adds the text to many files without blocking the event loop of
+    asyncio, see Renamer.rename_many():
+
+        async for result in appendfilename.rename_many(paths, "book", jobs=8):
+            ...
+
+    @param paths: asynchronous iterator or iterable of file names or os.DirEntry objects
+    @param text: string that shall be added to the file names
+    @param mode: one of MODE_APPEND, MODE_PREPEND, MODE_SMART_PREPEND
+    @param separator: string between the old file name and the new text
+    @param dryrun: boolean which defines if files should be changed (False) or not (True)
+    @param jobs: number of files which are handled in parallel
+    @param idempotent: boolean which defines if files already containing the text are skipped (True) or not (False)
+    @param on_conflict: one of CONFLICT_POLICIES for renames whose new name is already taken
+    @param return: asynchronous generator of dicts with the keys old, new, status, error, elapsed
+    """
+
+    renamer = Renamer(mode=mode, separator=separator, dryrun=dryrun, jobs=jobs, idempotent=idempotent,
+                      on_conflict=on_conflict)
+    return renamer.rename_many(paths, text)
+
+
+@functools.lru_cache(maxsize=None)
+def load_renameat2():
+    """
+    Looks up renameat2() of the C library, which is not available via
+    the os module.
+
+    @param return: function(src_dir_fd, src, dst_dir_fd, dst, flags) returning 0 or an errno; None if unavailable
+    """
+
+    if not sys.platform.startswith('linux'):
+        return None
+    import ctypes  # only needed for renaming, so it is imported here
+
+    try:
+        function = ctypes.CDLL(None, use_errno=True).renameat2
+    except (OSError, AttributeError):
+        return None  # a C library older than renameat2()
+    function.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+    function.restype = ctypes.c_int
 
+    def renameat2(src_dir_fd, src, dst_dir_fd, dst, flags):
+        if function(src_dir_fd, os.fsencode(src), dst_dir_fd, os.fsencode(dst), flags) == 0:
+            return 0
+        return ctypes.get_errno()
 
-def main():
-    """Main function"""
+    return renameat2
+
+
+def rename_noreplace(src, dst, src_dir_fd=None, dst_dir_fd=None):
+    """
+    Like os.rename() but raises FileExistsError instead of replacing an
+    existing dst. With one system call, this is atomic: renameat2()
+    with RENAME_NOREPLACE on Linux, a hard link to dst followed by the
+    removal of src where renameat2() or its flag is not supported.
+    Windows does not replace files on renames anyway. Only on file
+    systems without hard links, the existence of dst is checked before
+    the rename.
+
+    @param src: current file name, relative to src_dir_fd if given
+    @param dst: new file name, relative to dst_dir_fd if given
+    @param src_dir_fd: optional file descriptor of the directory of src
+    @param dst_dir_fd: optional file descriptor of the directory of dst
+    """
+
+    if os.name == 'nt':
+        os.rename(src, dst)
+        return
+
+    renameat2 = load_renameat2()
+    if renameat2:
+        error = renameat2(AT_FDCWD if src_dir_fd is None else src_dir_fd, src,
+                          AT_FDCWD if dst_dir_fd is None else dst_dir_fd, dst, RENAME_NOREPLACE)
+        if not error:
+            return
+        if error not in (errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+            raise OSError(error, os.strerror(error), src, None, dst)
+        # the kernel or the file system does not support RENAME_NOREPLACE
+
+    try:
+        if os.link in os.supports_follow_symlinks:
+            # a symbolic link is renamed itself and not its target:
+            os.link(src, dst, src_dir_fd=src_dir_fd, dst_dir_fd=dst_dir_fd, follow_symlinks=False)
+        else:
+            os.link(src, dst, src_dir_fd=src_dir_fd, dst_dir_fd=dst_dir_fd)
+    except OSError as error:
+        if error.errno not in (errno.EPERM, errno.EOPNOTSUPP, errno.EMLINK, errno.EXDEV):
+            raise
+        # no hard links on this file system
+        try:
+            os.stat(dst, dir_fd=dst_dir_fd, follow_symlinks=False)
+        except FileNotFoundError:
+            os.rename(src, dst, src_dir_fd=src_dir_fd, dst_dir_fd=dst_dir_fd)
+            return
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), src, None, dst)
+    os.unlink(src, dir_fd=src_dir_fd)
+
+
+class DirectoryHandles(object):
+    """
+    Keeps file descriptors of recently used directories open so that
+    files are renamed relative to their directory (renameat) instead of
+    resolving the whole path for each file. The number of open
+    directories is limited; the least recently used unused ones are
+    closed first. Where the operating system does not support renames
+    relative to directory descriptors, plain paths are used.
+    """
+
+    def __init__(self, max_open=MAX_OPEN_DIRECTORIES):
+        """
+        @param max_open: number of directory descriptors that are kept open
+        """
+
+        self.max_open = max_open
+        self.supported = os.rename in os.supports_dir_fd and os.link in os.supports_dir_fd
+        self.supports_stat = os.stat in os.supports_dir_fd and os.stat in os.supports_follow_symlinks
+        self.handles = collections.OrderedDict()  # directory -> [file descriptor or None, number of users]
+        self.lock = threading.Lock()
+        self.opened = 0  # number of successful os.open() calls, for statistics
+
+    def acquire(self, dirname):
+        """
+        @param dirname: directory as found in the file name; '' for the current directory
+        @param return: file descriptor of the directory or None if it could not be opened
+        """
+
+        with self.lock:
+            handle = self.handles.get(dirname)
+            if handle:
+                self.handles.move_to_end(dirname)
+                handle[1] += 1
+                return handle[0]
+
+        try:
+            fd = os.open(dirname or os.curdir, DIRECTORY_OPEN_FLAGS)
+        except OSError:
+            logging.debug('could not open directory "%s", using full paths instead', dirname)
+            fd = None
+
+        with self.lock:
+            if fd is not None:
+                self.opened += 1
+            handle = self.handles.get(dirname)
+            if handle:
+                # another thread was faster
+                if fd is not None:
+                    os.close(fd)
+            else:
+                handle = self.handles[dirname] = [fd, 0]
+                self._close_unused()
+            handle[1] += 1
+            return handle[0]
+
+    def release(self, dirname):
+        with self.lock:
+            self.handles[dirname][1] -= 1
+            self._close_unused()
+
+    def _close_unused(self):
+        """closes least recently used directories above the limit; needs self.lock"""
+
+        surplus = len(self.handles) - self.max_open
+        if surplus <= 0:
+            return
+        for dirname in [dirname for dirname, (fd, users) in self.handles.items() if users == 0][:surplus]:
+            fd = self.handles.pop(dirname)[0]
+            if fd is not None:
+                os.close(fd)
+
+    def stat(self, dirname, basename, follow_symlinks=True):
+        """
+        Like os.stat() of a file within a directory.
+
+        @param dirname: directory of the file; '' for the current directory
+        @param basename: file name without directory
+        @param follow_symlinks: boolean which defines if symbolic links are followed (like os.stat) or not (like os.lstat)
+        @param return: os.stat_result
+        """
+
+        if not self.supports_stat:
+            return os.stat(os.path.join(dirname, basename), follow_symlinks=follow_symlinks)
+
+        fd = self.acquire(dirname)
+        try:
+            if fd is None:
+                return os.stat(os.path.join(dirname, basename), follow_symlinks=follow_symlinks)
+            return os.stat(basename, dir_fd=fd, follow_symlinks=follow_symlinks)
+        finally:
+            self.release(dirname)
+
+    def rename(self, dirname, old_basename, new_basename):
+        """
+        Renames a file within its directory without replacing an
+        existing file, see rename_noreplace().
+
+        @param dirname: directory of the file; '' for the current directory
+        @param old_basename: current file name without directory
+        @param new_basename: new file name without directory
+        """
+
+        if not self.supported:
+            rename_noreplace(os.path.join(dirname, old_basename), os.path.join(dirname, new_basename))
+            return
+
+        fd = self.acquire(dirname)
+        try:
+            if fd is None:
+                rename_noreplace(os.path.join(dirname, old_basename), os.path.join(dirname, new_basename))
+            else:
+                rename_noreplace(old_basename, new_basename, src_dir_fd=fd, dst_dir_fd=fd)
+        finally:
+            self.release(dirname)
+
+    def close(self):
+        with self.lock:
+            for fd, users in self.handles.values():
+                if fd is not None:
+                    os.close(fd)
+            self.handles.clear()
+
+
+class Journal(object):
+    """
+    Append-only log of renames: one JSON object per line.
+
+    Before a group of files is renamed, their planned renames ("plan")
+    are written and synced to disk once for the whole group. Completed
+    renames ("done") and re-linked symbolic links ("relinked") are
+    written after each change and synced with the next group. After a
+    crash, only planned renames without "done" record are uncertain;
+    recover() checks just these in the file system.
+    """
+
+    def __init__(self, filename):
+        """
+        @param filename: file name of the journal; new records are appended
+        """
+
+        self.filename = filename
+        self.file = open(filename, 'a+', encoding='utf-8', errors='surrogateescape')
+        self.lock = threading.Lock()
+        # a crashed run may have left an incomplete line which must not be continued:
+        if self.file.tell() > 0:
+            self.file.seek(self.file.tell() - 1)
+            if self.file.read(1) != '\n':
+                self.file.write('\n')
+
+    def write(self, **record):
+        import json
+
+        with self.lock:
+            self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def plan(self, old, new):
+        self.write(op='plan', old=os.path.abspath(old), new=os.path.abspath(new))
+
+    def done(self, old, new):
+        self.write(op='done', old=os.path.abspath(old), new=os.path.abspath(new))
+
+    def relinked(self, link, old_target, new_target):
+        self.write(op='relinked', link=os.path.abspath(link), old=old_target, new=new_target)
+
+    def undone(self, entry):
+        self.write(op='undone', entry=list(entry))
+
+    def sync(self):
+        """writes all records to disk"""
+
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def entry(record):
+        """returns a tuple identifying a done or relinked record"""
+
+        return (record['op'], record.get('link', ''), record['old'], record['new'])
+
+    @staticmethod
+    def read(filename):
+        """
+        @param filename: file name of a journal
+        @param return: generator of records (dicts); an incomplete last line of a crashed run is skipped
+        """
+
+        import json
+
+        with open(filename, encoding='utf-8', errors='surrogateescape') as journalfile:
+            for line in journalfile:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    logging.debug('skipping incomplete journal record %s', repr(line))
+
+    def recover(self):
+        """
+        Determines the files that were already renamed according to the
+        journal. Planned renames without "done" record are checked in
+        the file system: if the old file is gone and the new one exists,
+        the rename happened but was not recorded, which is made up for.
+
+        Both the old and the new names of completed renames are
+        returned: a repeated run may get the file names from a glob or
+        find again, which then yields the new names.
+
+        @param return: set of absolute file names which must not be renamed again
+        """
+
+        done = {}  # old -> new absolute file name
+        pending = {}
+        for record in Journal.read(self.filename):
+            if record['op'] == 'plan':
+                pending[record['old']] = record['new']
+            elif record['op'] == 'done':
+                done[record['old']] = record['new']
+                pending.pop(record['old'], None)
+            elif record['op'] == 'undone' and record['entry'][0] == 'done':
+                done.pop(record['entry'][2], None)
+
+        recovered = 0
+        for old, new in pending.items():
+            if not os.path.lexists(old) and os.path.lexists(new):
+                self.done(old, new)
+                done[old] = new
+                recovered += 1
+        logging.debug('journal "%s": %i completed renames, %i of %i pending renames were completed',
+                      self.filename, len(done), recovered, len(pending))
+        return set(done) | set(done.values())
+
+
+def skip_completed(filenames, completed, output=None, key=None):
+    """
+    @param filenames: iterable of file names or os.DirEntry objects
+    @param completed: set of absolute file names, see Journal.recover()
+    @param output: optional JsonLinesWriter which gets a record for each skipped file
+    @param key: optional function which returns the file name of an item of filenames, e.g., of rows of read_mapping()
+    @param return: generator of the file names (or items) which are not completed
+    """
+
+    for item in filenames:
+        filename = key(item) if key else item
+        if os.path.abspath(filename) in completed:
+            logging.info('Skipping "%s" because it was already renamed according to the journal.', os.fspath(filename))
+            if output:
+                output.write({'old': os.fspath(filename), 'new': None, 'status': 'skipped', 'error': None,
+                              'elapsed': 0.0})
+        else:
+            yield item
+
+
+class JsonLinesWriter(object):
+    """
+    Writes one JSON object per line. The lines are collected and
+    written in chunks of OUTPUT_BUFFER_SIZE characters instead of
+    flushing the stream for each of them.
+    """
+
+    def __init__(self, stream, buffer_size=OUTPUT_BUFFER_SIZE):
+        """
+        @param stream: text stream like sys.stdout
+        @param buffer_size: number of characters which are collected before they are written
+        """
+
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.lines = []
+        self.size = 0
+        import json  # only needed for --output jsonl
+
+        self.encode = json.JSONEncoder().encode
+
+    def write(self, record):
+        """
+        @param record: dict which can be converted to JSON
+        """
+
+        line = self.encode(record) + '\n'
+        self.lines.append(line)
+        self.size += len(line)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.stream.write(''.join(self.lines))
+        self.stream.flush()
+        self.lines = []
+        self.size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+class ResultList(object):
+    """
+    Collects the result records of a Renamer (see Renamer.output) in a
+    list instead of writing them.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+
+@contextlib.contextmanager
+def profiled(filename):
+    """
+    Runs the body of the with statement with cProfile and writes the
+    statistics to filename at the end. Only the calling thread is
+    profiled.
+
+    @param filename: file name for the statistics, see the pstats module
+    """
+
+    import cProfile  # only needed for --profile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(filename)
+
+
+class _ThreadLogBuffer(logging.Filter):
+    """
+    Filter for the root logger which holds back the log records of
+    threads that called start() until they call stop().
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.local = threading.local()
+
+    def start(self):
+        self.local.records = []
+
+    def stop(self):
+        records = self.local.records
+        self.local.records = None
+        return records
+
+    def filter(self, record):
+        records = getattr(self.local, 'records', None)
+        if records is None:
+            return True
+        records.append(record)
+        return False
+
+
+class RenameService(object):
+    """
+    Renames files on behalf of clients connecting to a Unix domain socket
+    (--serve), so that frequent small requests do not pay for starting
+    the interpreter, importing this module and reading the vocabulary
+    each time. The TargetNames are kept for all requests as well.
+
+    Each request and each response is one JSON object per line; a
+    connection may send any number of requests. Requests have the key
+    "op":
+    - "rename": renames "files" (absolute file names) by adding "text";
+      optional keys are "mode", "separator", "dryrun", "idempotent" and
+      "on_conflict" like the arguments of Renamer. The response has the
+      number of "errors", the "results" (see --output jsonl) and the log
+      "messages" as pairs of level and text.
+    - "vocabulary": returns the "words" of the file names in
+      "directory" with their numbers, see count_controlled_vocabulary().
+      They are kept in memory as long as the directory does not change.
+    Invalid requests get a response with "error" only.
+    """
+
+    def __init__(self, cachedir=None, use_index=True):
+        """
+        @param cachedir: directory of the VocabularyIndex files
+        @param use_index: boolean which defines if the VocabularyIndex is used (True) or not (False)
+        """
+
+        self.cachedir = cachedir
+        self.use_index = use_index
+        self.vocabularies = {}  # directory -> (mtime_ns, scanned_ns, collections.Counter)
+        self.targets = TargetNames()  # kept for all requests, so directories are not read for each of them
+        self.logbuffer = _ThreadLogBuffer()
+        self.listener = None
+        self.path = None
+        self.ready = threading.Event()
+        self.stopped = False
+
+    def handle(self, request):
+        """
+        @param request: dict as sent by a client
+        @param return: dict of the response
+        """
+
+        try:
+            if not isinstance(request, dict):
+                raise ValueError('request is not a JSON object')
+            op = request.get('op')
+            if op == 'rename':
+                return self.rename(request)
+            if op == 'vocabulary':
+                return self.vocabulary(request)
+            raise ValueError('unknown op "%s"' % op)
+        except (ValueError, TypeError, OSError) as error:
+            return {'error': '%s: %s' % (type(error).__name__, error)}
+
+    def rename(self, request):
+        files = request.get('files')
+        text = request.get('text')
+        if not isinstance(files, list) or not all(isinstance(filename, str) for filename in files):
+            raise TypeError('"files" has to be a list of file names')
+        if not text or not isinstance(text, str):
+            raise TypeError('"text" has to be a non-empty string')
+
+        renamer = Renamer(mode=request.get('mode', MODE_APPEND),
+                          separator=request.get('separator', DEFAULT_TEXT_SEPARATOR),
+                          dryrun=bool(request.get('dryrun')), idempotent=bool(request.get('idempotent')),
+                          on_conflict=request.get('on_conflict', CONFLICT_FAIL))
+        if not renamer.dryrun:
+            # dry runs take names which are never created, so they do not share them:
+            renamer.kept_targets = self.targets
+        renamer.output = ResultList()
+        self.logbuffer.start()
+        try:
+            num_errors = renamer.rename_files(files, text)
+        finally:
+            records = self.logbuffer.stop()
+        return {'errors': num_errors, 'results': renamer.output.records,
+                'messages': [(record.levelno, record.getMessage()) for record in records]}
+
+    def vocabulary(self, request):
+        directory = request.get('directory')
+        if not directory or not isinstance(directory, str):
+            raise TypeError('"directory" has to be a directory name')
+
+        mtime_ns = os.stat(directory).st_mtime_ns
+        cached = self.vocabularies.get(directory)
+        # changes right before the last scan might not have changed the mtime, see VocabularyIndex:
+        if not (cached and cached[0] == mtime_ns and mtime_ns < cached[1] - VOCABULARY_INDEX_MTIME_GRANULARITY_NS):
+            scanned_ns = time.time_ns()
+            cached = self.vocabularies[directory] = (
+                mtime_ns, scanned_ns, count_controlled_vocabulary(directory, self.cachedir, self.use_index))
+        return {'words': cached[2]}
+
+    def handle_connection(self, connection):
+        """
+        Answers the requests of one client until it closes the connection.
+
+        @param connection: connected socket
+        """
+
+        import json
+
+        with connection, connection.makefile('rwb') as stream:
+            for line in stream:
+                try:
+                    request = json.loads(line)
+                except ValueError as error:
+                    response = {'error': 'ValueError: %s' % error}
+                else:
+                    response = self.handle(request)
+                # file names which are not valid UTF-8 are sent as escaped surrogates:
+                stream.write(json.dumps(response).encode('ascii') + b'\n')
+                stream.flush()
+
+    def serve(self, path):
+        """
+        Accepts connections on a Unix domain socket until stop() is
+        called. Each connection is handled by its own thread. The
+        socket can only be used by the current user.
+
+        @param path: file name of the socket; a stale socket of a previous run is replaced, other files are not
+        """
+
+        import socket  # only needed for --serve
+
+        try:
+            mode = os.lstat(path).st_mode
+        except FileNotFoundError:
+            mode = None
+        if mode is not None and not stat.S_ISSOCK(mode):
+            # connecting to any other file is refused as well, so it must not be removed:
+            raise FileExistsError(errno.EEXIST, 'Not a socket', path)
+        if mode is not None:
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except ConnectionRefusedError:
+                os.remove(path)
+            else:
+                raise OSError(errno.EADDRINUSE, 'Another server is listening', path)
+            finally:
+                probe.close()
+
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            self.listener.bind(path)
+        finally:
+            os.umask(umask)
+        self.path = path
+        self.listener.listen()
+        logging.getLogger().addFilter(self.logbuffer)
+        logging.info('serving on "%s"', path)
+        self.ready.set()
+        try:
+            while True:
+                connection = self.listener.accept()[0]
+                if self.stopped:
+                    connection.close()
+                    break
+                threading.Thread(target=self.handle_connection, args=(connection,), daemon=True).start()
+        finally:
+            logging.getLogger().removeFilter(self.logbuffer)
+            self.listener.close()
+            os.remove(path)
+
+    def stop(self):
+        """ends serve() after the connections accepted so far"""
+
+        import socket
+
+        self.stopped = True
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as wakeup:
+            wakeup.connect(self.path)
+
+
+class RenameClient(object):
+    """
+    Sends the work of a run to a RenameService (--connect) instead of
+    doing it in this process.
+    """
+
+    def __init__(self, path):
+        """
+        @param path: file name of the socket of the RenameService
+        """
+
+        import socket  # only needed for --connect
+
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.socket.connect(path)
+        except OSError:
+            self.socket.close()
+            raise
+        self.stream = self.socket.makefile('rwb')
+
+    def call(self, **request):
+        """
+        @param request: keys and values of one request, see RenameService
+        @param return: dict of the response
+        """
+
+        import json
+
+        self.stream.write(json.dumps(request).encode('ascii') + b'\n')
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError('The server closed the connection')
+        response = json.loads(line)
+        if 'error' in response:
+            raise ValueError('The server rejected the request: ' + response['error'])
+        return response
+
+    def word_counts(self, directory='.'):
+        """
+        @param directory: directory whose file names are parsed
+        @param return: collections.Counter like count_controlled_vocabulary()
+        """
+
+        return collections.Counter(self.call(op='vocabulary', directory=os.path.abspath(directory))['words'])
+
+    def rename_files(self, filenames, text, renamer):
+        """
+        Like Renamer.rename_files() but done by the server, in requests
+        of PLAN_GROUP_SIZE files. The log messages of the server are
+        logged here and the results are written to renamer.output.
+
+        @param filenames: iterable of file names or os.DirEntry objects
+        @param text: string that shall be added to file name(s)
+        @param renamer: Renamer whose mode, separator, dryrun, idempotent, on_conflict and output are used
+        @param return: number of errors
+        """
+
+        num_errors = 0
+        filenames = iter(filenames)
+        while True:
+            group = [os.path.abspath(filename) for filename in itertools.islice(filenames, PLAN_GROUP_SIZE)]
+            if not group:
+                return num_errors
+            response = self.call(op='rename', files=group, text=text, mode=renamer.mode,
+                                 separator=renamer.separator, dryrun=bool(renamer.dryrun),
+                                 idempotent=bool(renamer.idempotent), on_conflict=renamer.on_conflict)
+            for level, message in response['messages']:
+                logging.log(level, '%s', message)
+            if renamer.output:
+                for result in response['results']:
+                    renamer.output.write(result)
+            num_errors += response['errors']
+
+    def close(self):
+        self.stream.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main(argv=None):
+    """
+    Main function
+
+    @param argv: list of command line arguments without the program name; defaults to sys.argv[1:]
+    """
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = build_option_parser()
+    (options, args) = parser.parse_args(argv)
 
     if options.version:
         print(os.path.basename(sys.argv[0]) + " version " + PROG_VERSION_DATE)
         sys.exit(0)
 
-    handle_logging()
+    handle_logging(options)
 
     if options.verbose and options.quiet:
         error_exit(1, "Options \"--verbose\" and \"--quiet\" found. " +
@@ -384,30 +3221,106 @@ def main():
         error_exit(3, "Options \"--prepend\" and \"--smart-prepend\" found. " +
                    "This does not make any sense, you silly fool :-)")
 
-    if len(sys.argv) < 2:
+    if options.null and not options.files_from:
+        error_exit(5, "Option \"--null\" requires \"--files-from\".")
+
+    if options.files_from == '-' and not options.text:
+        error_exit(5, "Reading file names from stdin requires \"--text\" because stdin can not be used for both.")
+
+    if (options.include or options.exclude) and not options.recursive:
+        error_exit(5, "Options \"--include\" and \"--exclude\" require \"--recursive\".")
+
+    if options.map and (args or options.text or options.files_from or options.recursive):
+        error_exit(5, "Option \"--map\" can not be combined with file names, \"--text\", \"--files-from\" " +
+                   "or \"--recursive\".")
+
+    if options.serve and (args or options.text or options.files_from or options.map or options.undo or
+                          options.connect or options.journal or options.resume or options.prepend or
+                          options.smartprepend or options.dryrun or options.jobs > 1 or options.idempotent or
+                          options.recursive or options.on_conflict != CONFLICT_FAIL or options.output != 'log' or
+                          options.separator != DEFAULT_TEXT_SEPARATOR or options.stats or options.profile):
+        error_exit(5, "Option \"--serve\" can not be combined with file names or options for a single run.")
+
+    if options.connect and (options.journal or options.undo or options.map or options.jobs > 1 or
+                            options.stats or options.profile):
+        error_exit(5, "Option \"--connect\" can not be combined with \"--journal\", \"--undo\", \"--map\", " +
+                   "\"--jobs\", \"--stats\" or \"--profile\".")
+
+    if options.resume and not options.journal:
+        error_exit(5, "Option \"--resume\" requires \"--journal\".")
+
+    if options.jobs < 1:
+        error_exit(5, "Option \"--jobs\" requires a number of at least 1.")
+
+    if options.profile and options.jobs > 1:
+        error_exit(5, "Option \"--profile\" can not be combined with \"--jobs\" above 1 because the " +
+                   "renames in worker threads would be missing from the statistics.")
+
+    if len(argv) < 1:
         # not a single command line parameter is given -> print help instead of asking for a string
         parser.print_help()
         sys.exit(0)
 
+    if options.prepend:
+        mode = MODE_PREPEND
+    elif options.smartprepend:
+        mode = MODE_SMART_PREPEND
+    else:
+        mode = MODE_APPEND
+    renamer = Renamer(mode=mode, separator=options.separator, dryrun=options.dryrun, jobs=options.jobs,
+                      idempotent=options.idempotent, on_conflict=options.on_conflict)
+
+    if options.undo:
+        try:
+            with Journal(options.undo) as journal:
+                renamer.journal = journal
+                num_errors = renamer.undo(options.undo)
+        except OSError as error:
+            error_exit(6, 'Could not use journal "%s": %s' % (options.undo, error))
+        if num_errors > 0:
+            error_exit(4, str(num_errors) + ' error(s) occurred. Please check output above.')
+        return
+
+    if options.serve:
+        try:
+            RenameService(use_index=not options.no_vocabulary_index).serve(options.serve)
+        except OSError as error:
+            error_exit(6, 'Could not serve on "%s": %s' % (options.serve, error))
+        return
+
+    client = None
+    if options.connect:
+        try:
+            client = RenameClient(options.connect)
+        except OSError as error:
+            error_exit(6, 'Could not connect to "%s": %s' % (options.connect, error))
+
     text = options.text
 
-    if not text:
+    if not text and not options.map:
 
         logging.debug("interactive mode: asking for text ...")
         logging.info("Add text to file name ...")
 
-        vocabulary = locate_and_parse_controlled_vocabulary()
+        import readline  # for raw_input() reading from stdin
+
+        tabcompletiondescription = ''
+        if client:
+            vocabulary = client.word_counts()
+        else:
+            vocabulary = count_controlled_vocabulary(use_index=not options.no_vocabulary_index)
         if vocabulary:
 
-            assert(vocabulary.__class__ == list)
+            completer = SimpleCompleter(vocabulary, vocabulary, options.max_completions,
+                                        options.ignore_case_completion)
 
             # Register our completer function
-            readline.set_completer(SimpleCompleter(vocabulary).complete)
+            readline.set_completer(completer.complete)
 
             # Use the tab key for completion
             readline.parse_and_bind('tab: complete')
 
-            tabcompletiondescription = '; complete ' + str(len(vocabulary)) + ' words with TAB'
+            tabcompletiondescription = '; complete ' + str(len(completer.options)) + ' words with TAB'
 
         print('         (abort with Ctrl-C' + tabcompletiondescription + ')')
         print()
@@ -418,27 +3331,74 @@ def main():
             sys.stdout.flush()
             sys.exit(0)
 
-        logging.info("adding text \"%s\" ..." % text)
+        logging.info("adding text \"%s\" ...", text)
 
-    logging.debug("text found: [%s]" % text)
+    logging.debug("text found: [%s]", text)
 
     logging.debug("extracting list of files ...")
-    logging.debug("len(args) [%s]" % str(len(args)))
-    if len(args) < 1:
+    logging.debug("len(args) [%s]", len(args))
+    if len(args) < 1 and not options.files_from and not options.map:
         error_exit(2, "Please add at least one file name as argument")
-    files = args
-    logging.debug("%s filenames found: [%s]" % (str(len(files)), '], ['.join(files)))
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        # joining thousands of file names is not worth it without debug messages:
+        logging.debug("%s filenames found: [%s]", len(args), '], ['.join(args))
 
     logging.debug("iterate over files ...")
-    for filename in files:
-
-        if is_broken_link(filename):
-            # skip broken links completely and write error message:
-            logging.error('File "' + filename + '" is a broken symbolic link. Skipping this one …')
-
+    if options.stats:
+        renamer.stats = RunStats()
+    with contextlib.ExitStack() as stack:
+        if options.profile:
+            stack.enter_context(profiled(options.profile))
+        if options.output == 'jsonl':
+            renamer.output = stack.enter_context(JsonLinesWriter(sys.stdout))
+
+        files = args
+        if options.files_from:
+            logging.debug("reading further file names from \"%s\" ...", options.files_from)
+            filelist = stack.enter_context(open_filename_list(options.files_from))
+            files = itertools.chain(args, read_filenames(filelist, options.null))
+
+        row_errors = []
+        if options.map:
+            def report_row_error(line_number, problem):
+                logging.error('Skipping line %i of "%s": %s', line_number, options.map, problem)
+                row_errors.append(line_number)
+            logging.debug("reading file names and texts from \"%s\" ...", options.map)
+            files = read_mapping(stack.enter_context(open_filename_list(options.map)), report_row_error)
+
+        if options.journal:
+            try:
+                renamer.journal = stack.enter_context(Journal(options.journal))
+                if options.resume:
+                    completed = renamer.journal.recover()
+            except OSError as error:
+                error_exit(6, 'Could not use journal "%s": %s' % (options.journal, error))
+
+        walk_errors = []
+        if options.recursive:
+            def report_walk_error(error):
+                logging.error('Could not read directory "%s": %s', error.filename, error.strerror)
+                walk_errors.append(error)
+            files = expand_directories(files, options.include, options.exclude, report_walk_error)
+        if options.resume:
+            files = skip_completed(files, completed, renamer.output, key=(lambda row: row[0]) if options.map else None)
+
+        if options.map:
+            num_errors = renamer.rename_mapping(files)
+        elif client:
+            try:
+                with client:
+                    num_errors = client.rename_files(files, text, renamer)
+            except (OSError, ValueError) as error:
+                error_exit(6, 'Could not use server "%s": %s' % (options.connect, error))
         else:
-            # if filename is a symbolic link, tag the source file as well:
-            num_errors, new_filename = handle_file_and_symlink_source_if_found(filename, text, options.dryrun)
+            num_errors = renamer.rename_files(files, text)
+        num_errors += len(walk_errors) + len(row_errors)
+
+    logging.debug("file classification: %i stat() calls, %i saved compared to separate checks",
+                  renamer.counter.syscalls, renamer.counter.saved)
+    if renamer.stats:
+        print(renamer.stats.summary(), file=sys.stderr)
 
     if num_errors > 0:
         error_exit(4, str(num_errors) + ' error(s) occurred. Please check output above.')
@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+
+# name:    benchmark_appendfilename.py
+# license: GPL v3
+#
+"""Benchmarks for appendfilename.
+
+This script measures how fast appendfilename does its work.  Launch it
+from the root of the repository by
+
+```shell
+python benchmark_appendfilename.py
+```
+
+Each benchmark reports one or more measurements.  To catch regressions,
+first store the results of a known good state as baseline:
+
+```shell
+python benchmark_appendfilename.py --save-baseline baseline.json
+```
+
+and later compare against it:
+
+```shell
+python benchmark_appendfilename.py --baseline baseline.json
+```
+
+The comparison exits with return value 1 if a measurement got worse by
+more than the tolerance (default: 25 percent).  Measurements ending with
+`_ms` or `_us` are times (lower is better), measurements ending with
+`_per_s` are rates (higher is better), anything else is informational.
+
+Available benchmarks are listed by `--list` and can be selected by
+their names as arguments.  Benchmarks on synthetic files accept
+`--size` (10k, 100k or 1M files); their results are stored per size:
+
+```shell
+python benchmark_appendfilename.py --size 100k tree
+```
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import inspect
+import logging
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PROGRAM = os.path.join(ROOT, "appendfilename", "__init__.py")
+
+# modules a non-interactive run must not import
+INTERACTIVE_ONLY_MODULES = ["readline", "hashlib", "bisect", "json", "concurrent.futures"]
+
+# number of files of the synthetic trees
+SIZES = {"10k": 10**4, "100k": 10**5, "1M": 10**6}
+
+# every SYMLINK_RATIO-th file of a synthetic tree is a symbolic link
+SYMLINK_RATIO = 20
+
+BENCHMARKS = {}
+
+
+def benchmark(function):
+    """register a benchmark function returning a dict of measurements"""
+    BENCHMARKS[function.__name__.replace("benchmark_", "")] = function
+    return function
+
+
+def median_of_runs(command, runs, **kwargs):
+    """median wall clock time in ms of running command in a subprocess"""
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, **kwargs)
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations)
+
+
+def synthetic_words(count=300, seed=42):
+    """deterministic pseudo-words for synthetic file names"""
+    generator = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return sorted({generator.choice(letters).upper()
+                   + "".join(generator.choice(letters)
+                             for _ in range(generator.randint(3, 9)))
+                   for _ in range(count)})
+
+
+def synthetic_names(count, seed=42):
+    """unique file names mixing dates, times, tags and extensions
+
+    The mix covers what FILE_WITH_EXTENSION_REGEX and
+    WITHTIME_AND_SECONDS_PATTERN distinguish."""
+    generator = random.Random(seed)
+    words = synthetic_words()
+    names = []
+    for i in range(count):
+        first, second, tag = (generator.choice(words) for _ in range(3))
+        day = f"2021-{i % 12 + 1:02d}-{i % 28 + 1:02d}"
+        kind = i % 5
+        if kind == 0:
+            names.append(f"{day} {first} {second} {i}.jpg")
+        elif kind == 1:
+            names.append(f"{day}T10.20.30_{first} {i} -- {tag} {second.lower()}.txt")
+        elif kind == 2:
+            names.append(f"{first} {second} {i} -- {tag.lower()}.pdf")
+        elif kind == 3:
+            names.append(f"{first}_{second}_{i}")
+        else:
+            names.append(f"{day}T10:20 {first} {i}.tar.gz")
+    return names
+
+
+def make_tree(folder, count):
+    """creates count files in folder/files; every SYMLINK_RATIO-th one is
+    a symbolic link to a file with the same name in folder/originals
+
+    Returns the directory of the files."""
+    files = os.path.join(folder, "files")
+    originals = os.path.join(folder, "originals")
+    os.mkdir(files)
+    os.mkdir(originals)
+    for i, name in enumerate(synthetic_names(count)):
+        if i % SYMLINK_RATIO == SYMLINK_RATIO - 1 and hasattr(os, "symlink"):
+            open(os.path.join(originals, name), "w").close()
+            os.symlink(os.path.join(originals, name), os.path.join(files, name))
+        else:
+            open(os.path.join(files, name), "w").close()
+    return files
+
+
+def timed(function, *args, **kwargs):
+    """result and wall clock time in seconds of calling function"""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+@benchmark
+def benchmark_startup(runs=15):
+    """cold start of a non-interactive run (with `--text`)
+
+    Reports the median import time of the package as measured by
+    `python -X importtime`, the median wall clock time of renaming one
+    file and, as a check, the interactive-only modules that got
+    imported (has to be 0)."""
+
+    import_times = []
+    code = "import appendfilename"
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            check=True, capture_output=True, text=True,
+            cwd=ROOT)
+        match = re.search(r"\|\s*(\d+)\s*\|\s*appendfilename\s*$",
+                          result.stderr, re.MULTILINE)
+        import_times.append(int(match.group(1)) / 1000)
+
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, "test.txt")
+        with open(filename, mode="w", encoding="utf-8") as newfile:
+            newfile.write("This is a place holder.\n")
+        run_ms = median_of_runs([sys.executable, PROGRAM, "--text", "x",
+                                 "--dryrun", "--quiet", filename], runs)
+
+        check = ("import sys; sys.argv[0] = 'appendfilename'; "
+                 "import appendfilename; "
+                 "appendfilename.main(['--text', 'x', '--dryrun', '--quiet', "
+                 + repr(filename) + "]); "
+                 "print(sum(name in sys.modules for name in "
+                 + repr(INTERACTIVE_ONLY_MODULES) + "))")
+        result = subprocess.run([sys.executable, "-c", check], check=True,
+                                capture_output=True, text=True,
+                                cwd=ROOT)
+
+    return {"import_ms": statistics.median(import_times),
+            "run_ms": run_ms,
+            "interactive_modules_imported": int(result.stdout.strip())}
+
+
+@benchmark
+def benchmark_serve(runs=200):
+    """requests to a server started by `--serve`
+
+    Reports the median round trip time in milliseconds of renaming one
+    file (dry run) and of getting the vocabulary of a directory via a
+    persistent `RenameClient`, and the median wall clock time of a
+    new process renaming one file with `--connect` next to the same
+    run without server."""
+
+    import threading
+    sys.path.insert(0, ROOT)
+    import appendfilename
+
+    logging.basicConfig(level=logging.ERROR)
+    logging.getLogger().setLevel(logging.ERROR)
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, "test.txt")
+        with open(filename, mode="w", encoding="utf-8") as newfile:
+            newfile.write("This is a place holder.\n")
+        path = os.path.join(folder, "sock")
+        service = appendfilename.RenameService(use_index=False)
+        server = threading.Thread(target=service.serve, args=(path,))
+        server.start()
+        service.ready.wait()
+        try:
+            with appendfilename.RenameClient(path) as client:
+                requests = {
+                    "rename_ms": lambda: client.call(op="rename", files=[filename], text="x", dryrun=True),
+                    "vocabulary_ms": lambda: client.call(op="vocabulary", directory=folder)}
+                for key, request in requests.items():
+                    durations = []
+                    for _ in range(runs):
+                        _, duration = timed(request)
+                        durations.append(duration * 1000)
+                    results[key] = statistics.median(durations)
+            command = [sys.executable, PROGRAM, "--text", "x", "--dryrun", "--quiet", filename]
+            results["cli_ms"] = median_of_runs(command, 15)
+            results["cli_connect_ms"] = median_of_runs(command + ["--connect", path], 15)
+        finally:
+            service.stop()
+            server.join()
+    return results
+
+
+@benchmark
+def benchmark_planning(count=SIZES["1M"]):
+    """planning of new names without any file system access
+
+    Reports the number of file names per second that
+    `Renamer.plan()` handles in one bulk for each mode."""
+
+    sys.path.insert(0, ROOT)
+    import appendfilename
+
+    filenames = [f"dir{i % 100}/2021-01-{i % 28 + 1:02d} file {i} -- tag.txt"
+                 if i % 2 else f"dir{i % 100}/file {i}.txt"
+                 for i in range(count)]
+    results = {}
+    for mode in appendfilename.MODES:
+        renamer = appendfilename.Renamer(mode=mode)
+        start = time.perf_counter()
+        renamer.plan(filenames, "book")
+        duration = time.perf_counter() - start
+        results[mode.replace("-", "_") + "_per_s"] = count / duration
+    return results
+
+
+@benchmark
+def benchmark_parser(runs=5):
+    """parsing of file names compared to the regular expression
+
+    Reports the median time per name in microseconds of
+    `split_file_name()` and `split_positions()` next to
+    FILE_WITH_EXTENSION_REGEX they replace, for short names and for
+    machine-generated names with hundreds of characters."""
+
+    sys.path.insert(0, ROOT)
+    import appendfilename
+
+    lengths = {"short": 1, "long": 20}
+    words = synthetic_words()
+    results = {}
+    for label, repeat in lengths.items():
+        names = [name if repeat == 1 else
+                 name.replace(" ", " " + " ".join(words[:repeat]) + " ", 1)
+                 for name in synthetic_names(10**4)]
+        functions = {
+            "regex": lambda names: list(map(appendfilename.FILE_WITH_EXTENSION_REGEX.match, names)),
+            "parser": lambda names: list(map(appendfilename.split_file_name, names)),
+            "bulk_parser": appendfilename.split_positions}
+        for key, function in functions.items():
+            durations = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                function(names)
+                durations.append(time.perf_counter() - start)
+            results[f"{label}_{key}_us"] = statistics.median(durations) / len(names) * 10**6
+    return results
+
+
+@benchmark
+def benchmark_quiet(count=SIZES["10k"]):
+    """per-file overhead of a dry run in quiet mode
+
+    Reports the median time per file in microseconds of
+    `plan_new_name()` and of a dry run of `Renamer.rename_files()` on
+    existing files, for each mode.  With `--quiet`, log messages are
+    disabled, so none of them should be formatted."""
+
+    import logging
+    sys.path.insert(0, ROOT)
+    import appendfilename
+
+    results = {}
+    logging.basicConfig(level=logging.ERROR)
+    logging.getLogger().setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as folder:
+        filenames = []
+        for i in range(count):
+            filename = os.path.join(folder, f"2021-01-{i % 28 + 1:02d} file {i} -- tag.txt")
+            open(filename, mode="w").close()
+            filenames.append(filename)
+        basenames = [os.path.basename(filename) for filename in filenames]
+
+        for mode in appendfilename.MODES:
+            key = mode.replace("-", "_")
+            durations = []
+            for _ in range(5):
+                start = time.perf_counter()
+                for basename in basenames:
+                    appendfilename.plan_new_name(basename, "book", mode)
+                durations.append(time.perf_counter() - start)
+            results[key + "_plan_us"] = statistics.median(durations) / count * 10**6
+
+            renamer = appendfilename.Renamer(mode=mode, dryrun=True)
+            durations = []
+            for _ in range(5):
+                start = time.perf_counter()
+                renamer.rename_files(filenames, "book")
+                durations.append(time.perf_counter() - start)
+            results[key + "_dryrun_us"] = statistics.median(durations) / count * 10**6
+    return results
+
+
+@benchmark
+def benchmark_tree(count=SIZES["10k"]):
+    """rename pipeline on a synthetic directory
+
+    Creates a directory with count files whose names mix dates, times,
+    tags and extensions, with some of them being symbolic links.
+    Reports the files per second of planning, of a dry run and of
+    renaming them, the time of reading the vocabulary of the
+    directory with and without (cold and warm) index and the median
+    latency of TAB completion."""
+
+    sys.path.insert(0, ROOT)
+    import appendfilename
+
+    logging.basicConfig(level=logging.ERROR)
+    logging.getLogger().setLevel(logging.ERROR)
+    results = {"files": count}
+    with tempfile.TemporaryDirectory() as folder:
+        files = make_tree(folder, count)
+        cachedir = os.path.join(folder, "cache")
+        entries = list(appendfilename.walk_files(files))
+        results["symlinks"] = sum(entry.is_symlink() for entry in entries)
+
+        vocabulary, duration = timed(appendfilename.count_controlled_vocabulary,
+                                     files, use_index=False)
+        results["vocabulary_scan_ms"] = duration * 1000
+        # the index is only trusted for directories which were not changed
+        # within the granularity of their mtime, so the tree gets an old one:
+        os.utime(files, (1000000000, 1000000000))
+        _, duration = timed(appendfilename.count_controlled_vocabulary, files, cachedir)
+        results["vocabulary_index_cold_ms"] = duration * 1000
+        _, duration = timed(appendfilename.count_controlled_vocabulary, files, cachedir)
+        results["vocabulary_index_ms"] = duration * 1000
+
+        completer = appendfilename.SimpleCompleter(vocabulary, vocabulary)
+        prefixes = sorted({word[:length] for word in synthetic_words()
+                           for length in (1, 2, 3)})
+        durations = []
+        for prefix in prefixes:
+            _, duration = timed(completer.find_matches, prefix)
+            durations.append(duration)
+        results["completion_us"] = statistics.median(durations) * 10**6
+
+        renamer = appendfilename.Renamer(mode=appendfilename.MODE_SMART_PREPEND)
+        _, duration = timed(renamer.plan, entries, "book")
+        results["plan_per_s"] = count / duration
+
+        renamer = appendfilename.Renamer(dryrun=True)
+        _, duration = timed(renamer.rename_files, entries, "book")
+        results["dryrun_per_s"] = count / duration
+
+        renamer = appendfilename.Renamer()
+        errors, duration = timed(renamer.rename_files,
+                                 appendfilename.walk_files(files), "book")
+        results["rename_per_s"] = count / duration
+        results["rename_errors"] = errors
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """returns the list of measurements which got worse than the baseline"""
+    regressions = []
+    for name, measurements in results.items():
+        for key, value in measurements.items():
+            old = baseline.get(name, {}).get(key)
+            if old is None:
+                continue
+            if key.endswith(("_ms", "_us")):
+                worse = value > old * (1 + tolerance)
+            elif key.endswith("_per_s"):
+                worse = value < old * (1 - tolerance)
+            else:
+                worse = value != old
+            if worse:
+                regressions.append(f"{name}.{key}: {value:g} (baseline {old:g})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="benchmarks for appendfilename",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__)
+    parser.add_argument("benchmarks", nargs="*", metavar="BENCHMARK",
+                        help="names of the benchmarks to run (default: all)")
+    parser.add_argument("--list", action="store_true",
+                        help="list the available benchmarks and exit")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare the results with this baseline")
+    parser.add_argument("--save-baseline", metavar="FILE",
+                        help="store the results as baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="accepted relative regression (default: 0.25)")
+    parser.add_argument("--size", choices=SIZES,
+                        help="number of files of benchmarks on synthetic "
+                        "files (default: their own)")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, function in BENCHMARKS.items():
+            print(f"{name:20s} {function.__doc__.splitlines()[0]}")
+        return 0
+
+    names = args.benchmarks or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error("unknown benchmark(s): " + ", ".join(unknown))
+
+    results = {}
+    for name in names:
+        function = BENCHMARKS[name]
+        if "count" in inspect.signature(function).parameters:
+            # results depend on the number of files, so they are stored per size:
+            size = args.size or next(
+                label for label, count in SIZES.items()
+                if count == inspect.signature(function).parameters["count"].default)
+            result_name = f"{name}@{size}"
+            results[result_name] = function(count=SIZES[size])
+        else:
+            result_name = name
+            results[result_name] = function()
+        for key, value in results[result_name].items():
+            print(f"{result_name}.{key}: {value:g}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, mode="w", encoding="utf-8") as baselinefile:
+            json.dump(results, baselinefile, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baselinefile:
+            regressions = compare(results, json.load(baselinefile),
+                                  args.tolerance)
+        if regressions:
+            print("regressions compared to " + args.baseline + ":")
+            for regression in regressions:
+                print("  " + regression)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -26,6 +26,15 @@ and launch the tests by
 python -m pytest
 ```
 
+The tests call appendfilename within the process of pytest, each one in
+its own temporary directory, instead of starting a new interpreter per
+test.  Thus, with the plugin pytest-xdist, they may run in parallel, and
+with `--basetemp`, their files may be put on a tmpfs:
+
+```shell
+python -m pytest -n auto --basetemp=/dev/shm/appendfilename-tests
+```
+
 As a reminder, the following optional pytest flags may be useful to obtain
 a report tailored to your needs:
 
@@ -38,18 +47,48 @@ Equally keep in mind you can constrain pytest tests.  Labels assigned are
 - default:        test appendfilename's default string insertion
 - prepend:        test appendfilename's optional -p/--prepend flag
 - smart_prepend:  test appendfilename's optional --smart-prepend flag
+- api:            test appendfilename's importable interface
+- batch:          test appendfilename's processing of many files at once
+- vocabulary:     test appendfilename's words offered for tab completion
 """
 
+import io
 import re
+import json
 import os
+import sys
 import shlex
+import shutil
+import random
 import subprocess
 
 from itertools import product
 
 import pytest
 
-PROGRAM = os.path.join("appendfilename", "__init__.py")
+import appendfilename
+
+PROGRAM = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       "appendfilename", "__init__.py")
+
+
+@pytest.fixture
+def in_tmp_path(tmp_path, monkeypatch):
+    """run a test within its own temporary directory"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def run_appendfilename(arguments):
+    """run appendfilename with a list of command line arguments
+
+    Like `python appendfilename/__init__.py` with these arguments, but
+    within the process of pytest; fails the test if appendfilename
+    reports an error."""
+    try:
+        appendfilename.main(arguments)
+    except SystemExit as exit_info:
+        assert not exit_info.code, f"appendfilename exited with {exit_info.code}"
 
 # The following section tests the applications default pattern where a
 # string is added to the file name, just prior to the file's file
@@ -82,6 +121,7 @@ test_cases = list(product(arg1_values, arg2_values, arg3_values))
 
 
 @pytest.mark.default
+@pytest.mark.usefixtures("in_tmp_path")
 @pytest.mark.parametrize("arg1, arg2, arg3", test_cases)
 def test_append(arg1, arg2, arg3):
     """Test default which appends a string just prior file extension
@@ -95,9 +135,7 @@ def test_append(arg1, arg2, arg3):
         newfile.write("This is a place holder.\n")
 
     # run the test to be tested:
-    full_command = ["python", PROGRAM, arg1
-                    ] + shlex.split(arg2) + shlex.split(arg3)
-    subprocess.run(full_command, text=True, check=True)
+    run_appendfilename([arg1] + shlex.split(arg2) + shlex.split(arg3))
 
     # construct the new file name to be tested:
     if len(shlex.split(arg3)) == 0:
@@ -150,6 +188,7 @@ test_cases = list(product(arg1_values, arg2_values, arg3_values, arg4_values))
 
 
 @pytest.mark.prepend
+@pytest.mark.usefixtures("in_tmp_path")
 @pytest.mark.parametrize("arg1, arg2, arg3, arg4", test_cases)
 def test_prepend(arg1, arg2, arg3, arg4):
     """test to prepend a string to the original file name
@@ -164,10 +203,8 @@ def test_prepend(arg1, arg2, arg3, arg4):
         newfile.write("This is a place holder.\n")
 
     # run the test to be tested:
-    full_command = [
-        "python", PROGRAM, arg1
-        ] + shlex.split(arg2) + shlex.split(arg3) + shlex.split(arg4)
-    subprocess.run(full_command, text=True, check=True)
+    run_appendfilename([arg1] + shlex.split(arg2) + shlex.split(arg3)
+                       + shlex.split(arg4))
 
     # construct the new file name to be tested:
     if len(shlex.split(arg3)) == 0:
@@ -223,6 +260,7 @@ test_cases = list(product(arg1_values, arg2_values, arg3_values))
 
 
 @pytest.mark.smart_prepend
+@pytest.mark.usefixtures("in_tmp_path")
 @pytest.mark.parametrize("arg1, arg2, arg3", test_cases)
 def test_smart_prepend(arg1, arg2, arg3):
     """test the insertion of a new string just past the time stamp
@@ -240,9 +278,8 @@ def test_smart_prepend(arg1, arg2, arg3):
         newfile.write("this is a placeholder\n")
 
     # run `appendfilename` on this test file
-    run_appendfilename = " ".join(
-        ["python", PROGRAM, arg1, arg2, arg3, " --smart-prepend"])
-    subprocess.run(run_appendfilename, shell=True, check=True)
+    run_appendfilename([arg1] + shlex.split(arg2) + shlex.split(arg3)
+                       + ["--smart-prepend"])
 
     # construct the new file name to be testedt:
     old_filename = arg1
@@ -308,3 +345,959 @@ def test_smart_prepend(arg1, arg2, arg3):
     # check if the IS can process the new file / space cleaning
     os.remove(new_filename)
     assert os.path.isfile(new_filename) is False
+
+# The following section checks the importable interface which neither
+# parses command line arguments nor depends on global options.
+
+plan_cases = [
+    ("test.txt", appendfilename.MODE_APPEND, "test book.txt"),
+    ("test -- tag1 tag2.txt", appendfilename.MODE_APPEND,
+     "test book -- tag1 tag2.txt"),
+    ("test", appendfilename.MODE_APPEND, "test book"),
+    ("test.txt", appendfilename.MODE_PREPEND, "book test.txt"),
+    ("2021-12-31_test.txt", appendfilename.MODE_SMART_PREPEND,
+     "2021-12-31 book test.txt"),
+    ("test.txt", appendfilename.MODE_SMART_PREPEND, "book test.txt"),
+]
+
+
+@pytest.mark.api
+@pytest.mark.parametrize("basename, mode, expected", plan_cases)
+def test_plan_new_name(basename, mode, expected):
+    """check the pure computation of new file names"""
+    assert appendfilename.plan_new_name(basename, "book", mode, " ") == expected
+
+
+contains_cases = [
+    ("test book.txt", appendfilename.MODE_APPEND, True),
+    ("test book -- tag.txt", appendfilename.MODE_APPEND, True),
+    ("test.txt", appendfilename.MODE_APPEND, False),
+    ("test -- book.txt", appendfilename.MODE_APPEND, False),
+    ("testbook.txt", appendfilename.MODE_APPEND, False),
+    ("book test.txt", appendfilename.MODE_PREPEND, True),
+    ("test book.txt", appendfilename.MODE_PREPEND, False),
+    ("2021-12-31 book test.txt", appendfilename.MODE_SMART_PREPEND, True),
+    ("2021-12-31 test.txt", appendfilename.MODE_SMART_PREPEND, False),
+    ("book 2021-12-31 test.txt", appendfilename.MODE_SMART_PREPEND, True),
+    ("book test.txt", appendfilename.MODE_SMART_PREPEND, True),
+]
+
+
+@pytest.mark.api
+@pytest.mark.parametrize("basename, mode, expected", contains_cases)
+def test_contains_text(basename, mode, expected):
+    """check the detection of file names which already contain the text"""
+    assert appendfilename.contains_text(basename, "book", mode, " ") is expected
+
+
+# pieces of random file names for comparing the parser with the
+# regular expression it replaces
+name_pieces = [" -- ", ".", " ", "-", "_", ":", "T", "\n", "x", "txt", "é",
+               "٣", "²", "\u0301", "2021", "2021-12-31", "-01-0", "18.48",
+               ".22", "T18:48:22", "2021-1٣-31"]
+
+
+def random_names(seed, count=20000):
+    """deterministic random file names built from name_pieces"""
+    generator = random.Random(seed)
+    return ["".join(generator.choice(name_pieces)
+                    for _ in range(generator.randint(0, 8)))
+            for _ in range(count)]
+
+
+@pytest.mark.api
+@pytest.mark.parametrize("seed", range(3))
+def test_split_file_name(seed):
+    """check the parser of file names against FILE_WITH_EXTENSION_REGEX"""
+    names = random_names(seed)
+    positions = appendfilename.split_positions(names)
+    for name, position in zip(names, positions):
+        components = appendfilename.FILE_WITH_EXTENSION_REGEX.match(name)
+        expected = components and components.group(1, 2)
+        assert appendfilename.split_file_name(name) == expected
+        if position is not None:
+            assert (name[:position], name[position:]) == expected
+
+
+@pytest.mark.api
+@pytest.mark.parametrize("mode", appendfilename.MODES)
+@pytest.mark.parametrize("idempotent", [False, True])
+def test_plan_renames(mode, idempotent):
+    """check that the bulk planning matches the planning of single names"""
+    basenames = ([case[0] for case in plan_cases + contains_cases]
+                 + ["test\n", ".hidden", "a\nb.txt", "2021-12-31T23.59.58 x"])
+    # directories that look like file names must not change the new names:
+    filenames = basenames + [os.path.join(dirname, name) for name in basenames
+                             for dirname in ["dir", "2021-12-31 book -- tag.d", "x.y"]]
+    plans = appendfilename.plan_renames(filenames, "book", mode, " ", idempotent)
+
+    assert [plan.filename for plan in plans] == filenames
+    for plan in plans:
+        dirname, basename = os.path.split(plan.filename)
+        if idempotent and appendfilename.contains_text(basename, "book", mode, " "):
+            assert plan.skipped
+            continue
+        try:
+            expected = os.path.join(dirname, appendfilename.plan_new_name(basename, "book", mode, " "))
+        except ValueError:
+            expected = None
+        assert plan.new_filename == expected
+
+
+@pytest.mark.api
+def test_idempotent(tmp_path):
+    """check a repeated run with --idempotent does not add the text twice"""
+    expected = {appendfilename.MODE_APPEND: "2021-12-31 test book -- tag.txt",
+                appendfilename.MODE_PREPEND: "book 2021-12-31 test -- tag.txt",
+                appendfilename.MODE_SMART_PREPEND:
+                "2021-12-31 book test -- tag.txt"}
+
+    for mode in appendfilename.MODES:
+        folder = tmp_path / mode
+        folder.mkdir()
+        (folder / "2021-12-31 test -- tag.txt").write_text("place holder\n")
+        renamer = appendfilename.Renamer(mode=mode, idempotent=True)
+        for _ in range(2):
+            filenames = [str(folder / name) for name in os.listdir(folder)]
+            assert renamer.rename_files(filenames, "book") == 0
+        assert os.listdir(folder) == [expected[mode]]
+
+
+@pytest.mark.api
+def test_renamer(tmp_path):
+    """check a Renamer renames files without any command line parsing"""
+    renamer = appendfilename.Renamer(mode=appendfilename.MODE_PREPEND,
+                                     separator="_")
+    for name in ["a.txt", "b -- tag.txt"]:
+        (tmp_path / name).write_text("This is a place holder.\n")
+
+    num_errors = renamer.rename_files(
+        [str(tmp_path / "a.txt"), str(tmp_path / "b -- tag.txt"),
+         str(tmp_path / "missing.txt")], "book")
+
+    assert num_errors == 1
+    assert sorted(os.listdir(tmp_path)) == ["book_a.txt", "book_b -- tag.txt"]
+
+
+@pytest.mark.api
+def test_noninteractive_imports(tmp_path):
+    """check a run with --text does not import modules of other modes
+    (interactive, parallel, JSON output)"""
+    testfile = tmp_path / "test.txt"
+    testfile.write_text("This is a place holder.\n")
+    check = ("import sys, appendfilename; "
+             f"appendfilename.main(['-t', 'book', {str(testfile)!r}]); "
+             "print([name for name in ['readline', 'hashlib', 'bisect', 'json', 'concurrent.futures'] "
+             "if name in sys.modules])")
+
+    result = subprocess.run([sys.executable, "-c", check], check=True,
+                            capture_output=True, text=True)
+
+    assert result.stdout.strip() == "[]"
+    assert (tmp_path / "test book.txt").is_file()
+
+
+@pytest.mark.api
+def test_script(tmp_path):
+    """check the script itself since all other tests call main()"""
+    testfile = tmp_path / "test.txt"
+    testfile.write_text("This is a place holder.\n")
+
+    subprocess.run([sys.executable, PROGRAM, str(testfile), "-t", "book"],
+                   check=True)
+
+    assert (tmp_path / "test book.txt").is_file()
+
+# The following section checks the processing of file lists which are
+# read while being processed instead of being passed as arguments.
+
+
+@pytest.mark.batch
+@pytest.mark.parametrize("chunk_size", [1, 3, 1024])
+def test_read_filenames_nul_delimited(chunk_size):
+    """check the split of NUL separated lists across chunk borders"""
+    stream = io.StringIO("a.txt\0with\nnewline.txt\0\0last.txt")
+    assert list(appendfilename.read_filenames(stream, True, chunk_size)) == [
+        "a.txt", "with\nnewline.txt", "last.txt"]
+
+
+@pytest.mark.batch
+def test_read_filenames_newline_delimited():
+    """check the split of newline separated lists"""
+    stream = io.StringIO("a.txt\n\nwith space.txt\nlast.txt")
+    assert list(appendfilename.read_filenames(stream)) == [
+        "a.txt", "with space.txt", "last.txt"]
+
+
+@pytest.mark.batch
+@pytest.mark.parametrize("separator, extra_args", [("\n", []),
+                                                   ("\0", ["-0"])])
+def test_files_from(tmp_path, separator, extra_args):
+    """check --files-from combined with file names given as arguments"""
+    names = ["a.txt", "b.txt", "c -- tag.txt"]
+    for name in names:
+        (tmp_path / name).write_text("This is a place holder.\n")
+    filelist = tmp_path / "list"
+    filelist.write_text(separator.join(str(tmp_path / name)
+                                       for name in names[1:]))
+
+    appendfilename.main([str(tmp_path / names[0]), "-t", "book",
+                         "--files-from", str(filelist)] + extra_args)
+
+    assert sorted(os.listdir(tmp_path)) == [
+        "a book.txt", "b book.txt", "c book -- tag.txt", "list"]
+
+
+@pytest.mark.batch
+@pytest.mark.parametrize("content, delimiter", [("a.txt,C1\n\n\"b, c.txt\",C2,prepend\nd.txt,\n", ","),
+                                                ("a.txt\tC1\n\nb, c.txt\tC2\tprepend\nd.txt\t\n", "\t")])
+def test_read_mapping(content, delimiter):
+    """check CSV and TSV rows including invalid ones"""
+    content += delimiter.join(["e.txt", "C3", "upside-down"]) + "\n"
+    problems = []
+    rows = appendfilename.read_mapping(io.StringIO(content),
+                                       lambda line_number, problem: problems.append(line_number))
+    assert list(rows) == [("a.txt", "C1", None), ("b, c.txt", "C2", "prepend")]
+    assert problems == [4, 5]
+
+
+@pytest.mark.batch
+@pytest.mark.parametrize("jobs", ["1", "3"])
+def test_map(tmp_path, jobs):
+    """check --map with its own text and mode for each file"""
+    names = ["a.txt", "b.txt", "2021-01-02 c.txt", "d.txt"]
+    for name in names:
+        (tmp_path / name).write_text("This is a place holder.\n")
+    mapping = tmp_path / "mapping.tsv"
+    mapping.write_text("".join("%s\t%s\n" % row for row in [
+        (tmp_path / "a.txt", "C1"),
+        (tmp_path / "b.txt", "C2\tprepend"),
+        (tmp_path / "2021-01-02 c.txt", "C1\tsmart-prepend"),
+        (tmp_path / "missing.txt", "C3"),
+        (tmp_path / "d.txt", "C4\tsideways")]))
+
+    with pytest.raises(SystemExit) as exit_info:
+        appendfilename.main(["--map", str(mapping), "--jobs", jobs])
+    assert exit_info.value.code == 4
+
+    assert sorted(os.listdir(tmp_path)) == [
+        "2021-01-02 C1 c.txt", "C2 b.txt", "a C1.txt", "d.txt", "mapping.tsv"]
+
+
+@pytest.mark.batch
+@pytest.mark.parametrize("jobs", ["1", "3"])
+def test_map_rejected_files_release_names(tmp_path, jobs):
+    """check that files which are not renamed do not take their new
+    names from later files"""
+    (tmp_path / "a b.txt").write_text("a b.txt")
+    (tmp_path / "d").mkdir()
+    mapping = tmp_path / "mapping.tsv"
+    mapping.write_text("".join("%s\t%s\n" % row for row in [
+        (tmp_path / "a.txt", "b c"),
+        (tmp_path / "d", "e"),
+        (tmp_path / "a b.txt", "c")]))
+
+    with pytest.raises(SystemExit) as exit_info:
+        appendfilename.main(["--map", str(mapping), "--jobs", jobs])
+    assert exit_info.value.code == 4
+
+    assert sorted(os.listdir(tmp_path)) == ["a b c.txt", "d", "mapping.tsv"]
+
+
+@pytest.mark.batch
+def test_target_names_are_bounded(tmp_path):
+    """check that only the names of a limited number of directories
+    without pending renames are kept"""
+    renamer = appendfilename.Renamer(on_conflict=appendfilename.CONFLICT_SUFFIX)
+    renamer.targets = appendfilename.TargetNames(max_directories=2)
+    filenames = []
+    for i in range(5):
+        (tmp_path / str(i)).mkdir()
+        (tmp_path / str(i) / "a.txt").write_text("a")
+        filenames.append(str(tmp_path / str(i) / "a.txt"))
+
+    plans = renamer.resolve_conflicts(renamer.plan(filenames, "book"))
+    assert len(renamer.targets.taken) == 5  # all renames are pending
+    for plan in plans:
+        renamer.apply_plan(plan, "book")
+    assert len(renamer.targets.taken) == 2
+    assert renamer.targets.scanned == 5
+    assert all(os.listdir(tmp_path / str(i)) == ["a book.txt"] for i in range(5))
+
+
+@pytest.mark.batch
+@pytest.mark.parametrize("jobs", ["1", "3"])
+def test_output_jsonl(tmp_path, capsys, jobs):
+    """check --output jsonl writes one record per file in input order"""
+    for name in ["a.txt", "a book.txt", "b.txt"]:
+        (tmp_path / name).write_text(name)
+    (tmp_path / "d").mkdir()
+    filenames = [str(tmp_path / name) for name in ["a.txt", "b.txt", "d"]]
+
+    with pytest.raises(SystemExit) as exit_info:
+        appendfilename.main(["-t", "book", "--output", "jsonl", "--quiet",
+                             "--jobs", jobs] + filenames)
+    assert exit_info.value.code == 4
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(record["old"], record["status"], record["error"]) for record in records] == [
+        (filenames[0], "failed", "FileExistsError"),
+        (filenames[1], "renamed", None),
+        (filenames[2], "failed", "IsADirectoryError")]
+    assert [record["new"] for record in records] == [None, str(tmp_path / "b book.txt"), None]
+    assert all(record["elapsed"] >= 0 for record in records)
+
+    # files skipped because of a conflict have the error as well:
+    run_appendfilename(["-t", "book", "--output", "jsonl", "--quiet", "--on-conflict", "skip",
+                        "--jobs", jobs, filenames[0], str(tmp_path / "b book.txt")])
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(record["new"], record["status"], record["error"]) for record in records] == [
+        (None, "skipped", "FileExistsError"), (str(tmp_path / "b book book.txt"), "renamed", None)]
+
+
+@pytest.mark.batch
+def test_stats_and_profile(tmp_path, capsys):
+    """check --stats reports phases and system calls and --profile writes pstats data"""
+    import pstats
+
+    for name in ["a.txt", "b.txt"]:
+        (tmp_path / name).write_text(name)
+    profile = tmp_path / "profile"
+
+    run_appendfilename(["-t", "book", "--quiet", "--stats", "--profile", str(profile),
+                        str(tmp_path / "a.txt"), str(tmp_path / "b.txt")])
+
+    summary = capsys.readouterr().err
+    assert summary.startswith("2 files in ")
+    for phase in appendfilename.RunStats.PHASES:
+        assert re.search(r"^  %s +\d+ times" % phase, summary, re.MULTILINE)
+    assert "p50" in summary and "p99" in summary
+    assert re.search(r"system calls:.*rename 2", summary)
+    assert any(function == "rename_files" for _, _, function in pstats.Stats(str(profile)).stats)
+
+    # worker threads are not profiled:
+    with pytest.raises(SystemExit) as exit_info:
+        appendfilename.main(["-t", "book", "--jobs", "4", "--profile", str(profile), str(tmp_path / "a book.txt")])
+    assert exit_info.value.code == 5
+    assert (tmp_path / "a book.txt").exists()
+
+
+@pytest.mark.batch
+@pytest.mark.skipif(sys.platform == "win32",
+                    reason="symbolic links require privileges in Windows")
+def test_parallel_jobs_match_sequential(tmp_path, caplog):
+    """check --jobs renames and reports like a sequential run
+
+    The list contains a chain where one rename takes the name a
+    former input had and symbolic links to originals with the same
+    name."""
+
+    results = []
+    for jobs in [1, 4]:
+        folder = tmp_path / str(jobs)
+        (folder / "originals").mkdir(parents=True)
+        names = ["a book.txt", "a.txt"] + [f"{i}.txt" for i in range(50)]
+        for name in names:
+            (folder / name).write_text(name)
+        for i in range(3):
+            (folder / "originals" / f"link{i}.txt").write_text("original")
+            os.symlink(folder / "originals" / f"link{i}.txt",
+                       folder / f"link{i}.txt")
+        filenames = [str(folder / name) for name in names]
+        filenames += [str(folder / f"link{i}.txt") for i in range(3)]
+        filenames += [str(folder / "missing.txt")]
+
+        caplog.clear()
+        renamer = appendfilename.Renamer(jobs=jobs)
+        num_errors = renamer.rename_files(filenames, "book")
+
+        messages = [record.getMessage().replace(str(folder), "")
+                    for record in caplog.records]
+        results.append((num_errors, sorted(os.listdir(folder)),
+                        sorted(os.listdir(folder / "originals")),
+                        (folder / "a book.txt").read_text(), messages))
+
+    assert results[0] == results[1]
+    assert results[0][0] == 1
+
+
+conflict_cases = [
+    (appendfilename.CONFLICT_FAIL, 1, ["a book.txt", "a.txt", "b book -- tag.txt"]),
+    (appendfilename.CONFLICT_SKIP, 0, ["a book.txt", "a.txt", "b book -- tag.txt"]),
+    (appendfilename.CONFLICT_SUFFIX, 0,
+     ["a book (2).txt", "a book.txt", "b book -- tag.txt"]),
+]
+
+
+@pytest.mark.batch
+@pytest.mark.parametrize("policy, expected_errors, expected_names", conflict_cases)
+def test_conflicts(tmp_path, policy, expected_errors, expected_names):
+    """check that existing new names are neither overwritten nor
+    taken twice within a batch"""
+    for name in ["a.txt", "a book.txt", "b -- tag.txt"]:
+        (tmp_path / name).write_text(name)
+    filenames = [str(tmp_path / "a.txt"), str(tmp_path / "b -- tag.txt")]
+
+    renamer = appendfilename.Renamer(on_conflict=policy)
+    assert renamer.rename_files(filenames, "book") == expected_errors
+    assert sorted(os.listdir(tmp_path)) == expected_names
+    assert (tmp_path / "a book.txt").read_text() == "a book.txt"
+
+    # the same file given twice: the second one must not take the new name again
+    (tmp_path / "c.txt").write_text("c.txt")
+    filenames = [str(tmp_path / "c.txt"), os.path.join(str(tmp_path), ".", "c.txt")]
+    plans = renamer.resolve_conflicts(renamer.plan(filenames, "book"))
+    assert [plan.conflict for plan in plans] == [False, policy != appendfilename.CONFLICT_SUFFIX]
+
+
+@pytest.mark.batch
+@pytest.mark.parametrize("count, policy, dryrun, expected_scans", [
+    (3, appendfilename.CONFLICT_FAIL, False, 0),
+    (3, appendfilename.CONFLICT_SKIP, False, 0),
+    (3, appendfilename.CONFLICT_SUFFIX, False, 1),
+    (3, appendfilename.CONFLICT_FAIL, True, 1),
+    (appendfilename.READ_DIRECTORY_MIN_RENAMES, appendfilename.CONFLICT_FAIL, False, 1),
+])
+def test_target_directories_are_read_when_needed(tmp_path, count, policy, dryrun, expected_scans):
+    """check that directories are only read for numbered names, dry
+    runs and many renames into them, while conflicts with existing
+    files are found in any case"""
+    (tmp_path / "0 book.txt").write_text("other")
+    filenames = []
+    for i in range(count):
+        (tmp_path / f"{i}.txt").write_text("This is a place holder.\n")
+        filenames.append(str(tmp_path / f"{i}.txt"))
+
+    renamer = appendfilename.Renamer(on_conflict=policy, dryrun=dryrun)
+    renamer.stats = appendfilename.RunStats()
+    num_errors = renamer.rename_files(filenames, "book")
+
+    assert renamer.stats.syscalls.get("scandir", 0) == expected_scans
+    assert num_errors == (1 if policy == appendfilename.CONFLICT_FAIL else 0)
+    assert (tmp_path / "0 book.txt").read_text() == "other"
+
+
+@pytest.mark.batch
+@pytest.mark.skipif(sys.platform == "win32",
+                    reason="Windows never replaces files on renames")
+@pytest.mark.parametrize("renameat2", [True, False])
+def test_rename_noreplace(tmp_path, monkeypatch, renameat2):
+    """check that renames never replace files, with renameat2() and
+    with its fallback of hard links"""
+    if not renameat2:
+        monkeypatch.setattr(appendfilename, "load_renameat2", lambda: None)
+    (tmp_path / "a.txt").write_text("a")
+    (tmp_path / "b.txt").write_text("b")
+    os.symlink("a.txt", tmp_path / "link.txt")
+
+    with pytest.raises(FileExistsError):
+        appendfilename.rename_noreplace(str(tmp_path / "a.txt"), str(tmp_path / "b.txt"))
+    assert (tmp_path / "a.txt").read_text() == "a"
+    assert (tmp_path / "b.txt").read_text() == "b"
+
+    appendfilename.rename_noreplace(str(tmp_path / "a.txt"), str(tmp_path / "c.txt"))
+    appendfilename.rename_noreplace(str(tmp_path / "link.txt"), str(tmp_path / "link2.txt"))
+    assert sorted(os.listdir(tmp_path)) == ["b.txt", "c.txt", "link2.txt"]
+    assert os.readlink(tmp_path / "link2.txt") == "a.txt"
+
+    # a new name which got taken after planning:
+    renamer = appendfilename.Renamer()
+    plans = renamer.resolve_conflicts(renamer.plan([str(tmp_path / "b.txt")], "book"))
+    (tmp_path / "b book.txt").write_text("other")
+    assert renamer.apply(plans, "book") == 1
+    assert (tmp_path / "b book.txt").read_text() == "other"
+    assert (tmp_path / "b.txt").read_text() == "b"
+
+
+@pytest.mark.batch
+@pytest.mark.skipif(sys.platform == "win32",
+                    reason="symbolic links require privileges in Windows")
+@pytest.mark.parametrize("dryrun", [False, True])
+def test_symlink_farm(tmp_path, caplog, dryrun):
+    """check that links sharing one original rename it once and all
+    of them get re-linked, keeping relative targets relative"""
+    (tmp_path / "originals").mkdir()
+    (tmp_path / "originals" / "x.txt").write_text("original")
+    targets = {"links1": "../originals/x.txt", "links2": "../originals/x.txt",
+               "links3": str(tmp_path / "originals" / "x.txt")}
+    for folder, target in targets.items():
+        (tmp_path / folder).mkdir()
+        os.symlink(target, tmp_path / folder / "x.txt")
+
+    caplog.set_level("INFO")
+    renamer = appendfilename.Renamer(dryrun=dryrun)
+    assert renamer.rename_files([str(tmp_path / folder / "x.txt")
+                                 for folder in targets], "book") == 0
+
+    source_renames = [record for record in caplog.records
+                      if record.getMessage() == f' renaming "{tmp_path}/links1/../originals/x.txt"']
+    if dryrun:
+        assert len(source_renames) == 1
+        assert os.listdir(tmp_path / "originals") == ["x.txt"]
+        return
+    assert os.listdir(tmp_path / "originals") == ["x book.txt"]
+    assert os.readlink(tmp_path / "links1" / "x book.txt") == "../originals/x book.txt"
+    assert os.readlink(tmp_path / "links2" / "x book.txt") == "../originals/x book.txt"
+    assert os.readlink(tmp_path / "links3" / "x book.txt") == str(tmp_path / "originals" / "x book.txt")
+    assert (tmp_path / "links2" / "x book.txt").read_text() == "original"
+    assert sorted(os.listdir(tmp_path / "links2")) == ["x book.txt"]
+
+
+@pytest.mark.batch
+@pytest.mark.skipif(sys.platform == "win32",
+                    reason="symbolic links require privileges in Windows")
+@pytest.mark.parametrize("policy, expected_errors, expected_name", [
+    (appendfilename.CONFLICT_FAIL, 2, "y.txt"),
+    (appendfilename.CONFLICT_SKIP, 0, "y.txt"),
+    (appendfilename.CONFLICT_SUFFIX, 0, "y book (2).txt"),
+])
+def test_symlink_conflicts(tmp_path, policy, expected_errors, expected_name):
+    """check that links and their sources keep their common basename
+    if the new name of the source is taken"""
+    (tmp_path / "originals").mkdir()
+    (tmp_path / "originals" / "y.txt").write_text("original")
+    (tmp_path / "originals" / "y book.txt").write_text("other")
+    for folder in ["links1", "links2"]:
+        (tmp_path / folder).mkdir()
+        os.symlink("../originals/y.txt", tmp_path / folder / "y.txt")
+
+    renamer = appendfilename.Renamer(on_conflict=policy)
+    assert renamer.rename_files([str(tmp_path / folder / "y.txt")
+                                 for folder in ["links1", "links2"]], "book") == expected_errors
+
+    assert sorted(os.listdir(tmp_path / "originals")) == sorted(["y book.txt", expected_name])
+    assert (tmp_path / "originals" / "y book.txt").read_text() == "other"
+    for folder in ["links1", "links2"]:
+        assert os.listdir(tmp_path / folder) == [expected_name]
+        assert (tmp_path / folder / expected_name).read_text() == "original"
+
+
+@pytest.mark.batch
+@pytest.mark.skipif(sys.platform == "win32",
+                    reason="symbolic links require privileges in Windows")
+def test_symlink_relink_failures(tmp_path, monkeypatch):
+    """check that links with long names are re-linked and that a
+    failed re-link never leaves a link pointing to nothing"""
+    (tmp_path / "originals").mkdir()
+    name = "x" * 230 + ".txt"
+    (tmp_path / "originals" / name).write_text("original")
+    (tmp_path / "links").mkdir()
+    os.symlink("../originals/" + name, tmp_path / "links" / name)
+
+    assert appendfilename.Renamer().rename_files([str(tmp_path / "links" / name)], "book") == 0
+    new_name = "x" * 230 + " book.txt"
+    assert os.listdir(tmp_path / "originals") == [new_name]
+    assert (tmp_path / "links" / new_name).read_text() == "original"
+
+    # the source renamed for the failing link is renamed back:
+    replace_symlink = appendfilename.replace_symlink
+    calls = []
+
+    def failing_replace_symlink(failing_call):
+        def replace(link, target):
+            calls.append(link)
+            if len(calls) == failing_call:
+                raise PermissionError("Permission denied")
+            replace_symlink(link, target)
+        calls.clear()
+        return replace
+
+    monkeypatch.setattr(appendfilename, "replace_symlink", failing_replace_symlink(1))
+    (tmp_path / "originals" / "y.txt").write_text("y")
+    for folder in ["links1", "links2"]:
+        (tmp_path / folder).mkdir()
+        os.symlink("../originals/y.txt", tmp_path / folder / "y.txt")
+    assert appendfilename.Renamer().rename_files([str(tmp_path / "links1" / "y.txt")], "book") == 1
+    assert (tmp_path / "originals" / "y.txt").is_file()
+    assert (tmp_path / "links1" / "y.txt").read_text() == "y"
+
+    # a source renamed for another link before stays, the link is created again:
+    monkeypatch.setattr(appendfilename, "replace_symlink", failing_replace_symlink(2))
+    assert appendfilename.Renamer().rename_files([str(tmp_path / folder / "y.txt")
+                                                  for folder in ["links1", "links2"]], "book") == 0
+    assert sorted(os.listdir(tmp_path / "originals")) == [new_name, "y book.txt"]
+    for folder in ["links1", "links2"]:
+        assert os.readlink(tmp_path / folder / "y book.txt") == "../originals/y book.txt"
+
+
+@pytest.mark.batch
+def test_directory_handles(tmp_path):
+    """check renames relative to directory handles beyond their limit"""
+    filenames = []
+    for i in range(5):
+        (tmp_path / str(i)).mkdir()
+        for name in ["a.txt", "b.txt"]:
+            (tmp_path / str(i) / name).write_text("This is a place holder.\n")
+            filenames.append(str(tmp_path / str(i) / name))
+
+    handles = appendfilename.DirectoryHandles(max_open=2)
+    for filename in filenames:
+        dirname, basename = os.path.split(filename)
+        handles.rename(dirname, basename, "new " + basename)
+        assert len(handles.handles) <= 2
+    handles.close()
+
+    assert not handles.handles
+    for i in range(5):
+        assert sorted(os.listdir(tmp_path / str(i))) == ["new a.txt",
+                                                         "new b.txt"]
+
+
+@pytest.mark.batch
+@pytest.mark.skipif(sys.platform == "win32",
+                    reason="symbolic links require privileges in Windows")
+def test_classify_file(tmp_path):
+    """check the classification of file names by one lstat() and stat()"""
+    (tmp_path / "file.txt").write_text("This is a place holder.\n")
+    (tmp_path / "folder").mkdir()
+    os.symlink(tmp_path / "file.txt", tmp_path / "link.txt")
+    os.symlink(tmp_path / "folder", tmp_path / "folderlink")
+    os.symlink(tmp_path / "missing.txt", tmp_path / "broken.txt")
+
+    counter = appendfilename.ClassificationCounter()
+    info = {name: appendfilename.classify_file(str(tmp_path / name),
+                                               counter=counter)
+            for name in ["file.txt", "folder", "link.txt", "folderlink",
+                         "broken.txt", "missing.txt"]}
+
+    assert info["file.txt"] == (False, True, False, True)
+    assert info["folder"] == (False, False, True, True)
+    assert info["link.txt"] == (True, True, False, True)
+    assert info["folderlink"] == (True, False, True, True)
+    assert info["broken.txt"] == (True, False, False, False)
+    assert info["missing.txt"] == (False, False, False, False)
+    assert counter.syscalls == 9
+
+    for name, expected in [("file.txt", False), ("link.txt", True),
+                           ("broken.txt", False), ("missing.txt", False)]:
+        assert appendfilename.is_nonbroken_symlink_file(
+            str(tmp_path / name)) is expected
+        assert appendfilename.is_broken_link(
+            str(tmp_path / name)) is (name == "broken.txt")
+
+    renamer = appendfilename.Renamer()
+    assert renamer.rename_files([str(tmp_path / "file.txt")], "book") == 0
+    assert renamer.counter.syscalls == 1
+    assert renamer.counter.saved == 4
+
+
+@pytest.mark.batch
+def test_recursive(tmp_path):
+    """check --recursive with --include and --exclude patterns"""
+    for name in ["a.txt", "b.jpg", "sub/c.txt", "sub/deeper/d.txt",
+                 "skipped/e.txt", "sub/skipped.txt"]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text("This is a place holder.\n")
+
+    walked = appendfilename.walk_files(str(tmp_path), ["*.txt"], ["skip*"])
+    assert [entry.name for entry in walked] == ["a.txt", "c.txt", "d.txt"]
+
+    appendfilename.main([str(tmp_path), "-t", "book", "-r",
+                         "--include", "*.txt", "--exclude", "skip*"])
+
+    found = sorted(os.path.relpath(os.path.join(folder, name), tmp_path)
+                   for folder, _, names in os.walk(tmp_path)
+                   for name in names)
+    assert found == sorted(["a book.txt", "b.jpg",
+                            os.path.join("skipped", "e.txt"),
+                            os.path.join("sub", "c book.txt"),
+                            os.path.join("sub", "deeper", "d book.txt"),
+                            os.path.join("sub", "skipped.txt")])
+
+
+@pytest.mark.batch
+@pytest.mark.skipif(sys.platform == "win32",
+                    reason="symbolic links need extra permissions on Windows")
+def test_recursive_skips_directory_links(tmp_path):
+    """check --recursive neither follows nor reports links to directories"""
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "a.txt").write_text("This is a place holder.\n")
+    os.symlink(tmp_path / "sub", tmp_path / "link")
+
+    run_appendfilename([str(tmp_path), "-t", "book", "-r"])
+
+    assert sorted(os.listdir(tmp_path)) == ["link", "sub"]
+    assert os.listdir(tmp_path / "sub") == ["a book.txt"]
+
+
+@pytest.mark.batch
+def test_recursive_without_stat(tmp_path):
+    """check files found by walk_files() do not need to be stat()ed again"""
+    for i in range(10):
+        (tmp_path / f"{i}.txt").write_text("This is a place holder.\n")
+
+    renamer = appendfilename.Renamer()
+    assert renamer.rename_files(appendfilename.walk_files(str(tmp_path)),
+                                "book") == 0
+    assert renamer.counter.syscalls == 0
+    assert sorted(os.listdir(tmp_path)) == [f"{i} book.txt" for i in range(10)]
+
+# The following section checks the words which are offered for tab
+# completion in the interactive mode.
+
+
+@pytest.mark.vocabulary
+def test_vocabulary_index(tmp_path, monkeypatch):
+    """check the index only splits new file names into words"""
+    folder = tmp_path / "files"
+    folder.mkdir()
+    for name in ["Holiday Italy.jpg", "Meeting Notes -- work.txt", "x.txt"]:
+        (folder / name).write_text("This is a place holder.\n")
+    # changes within the last seconds do not necessarily change the mtime:
+    os.utime(folder, (1000000000, 1000000000))
+
+    index = appendfilename.VocabularyIndex(str(folder), str(tmp_path / "cache"))
+    assert index.word_counts() == index.word_counts()
+    assert sorted(index.word_counts()) == ["Holiday", "Italy", "Meeting",
+                                           "Notes", "work"]
+
+    # an unchanged directory is not read at all:
+    with monkeypatch.context() as patch:
+        patch.setattr(os, "scandir", None)
+        assert len(appendfilename.VocabularyIndex(
+            str(folder), str(tmp_path / "cache")).word_counts()) == 5
+
+    (folder / "Holiday Spain.jpg").write_text("This is a place holder.\n")
+    os.utime(folder, (1000000010, 1000000010))
+    index = appendfilename.VocabularyIndex(str(folder), str(tmp_path / "cache"))
+    assert index.word_counts()["Holiday"] == 2
+    assert index.tokenized == 1
+
+    vocabulary = appendfilename.locate_and_parse_controlled_vocabulary(
+        str(folder), str(tmp_path / "cache"))
+    assert vocabulary[:5] == appendfilename.INITIAL_CONTROLLED_VOCABULARY
+    assert sorted(vocabulary[5:]) == ["Holiday", "Italy", "Meeting", "Notes",
+                                      "Spain", "work"]
+    assert sorted(vocabulary) == sorted(
+        appendfilename.locate_and_parse_controlled_vocabulary(
+            str(folder), use_index=False))
+
+
+@pytest.mark.vocabulary
+def test_completion_by_frequency(tmp_path):
+    """check frequent words are offered first and the optional limit"""
+    for name in ["Meeting Notes.txt", "Meeting Minutes.txt", "Meeting.txt",
+                 "Minutes.txt", "Mexico.txt"]:
+        (tmp_path / name).write_text("This is a place holder.\n")
+
+    vocabulary = appendfilename.count_controlled_vocabulary(str(tmp_path),
+                                                            use_index=False)
+    assert vocabulary["Meeting"] == 3
+    assert vocabulary["Karl"] == 0
+
+    completer = appendfilename.SimpleCompleter(vocabulary, vocabulary)
+    candidates = [completer.complete("M", state) for state in range(4)]
+    assert candidates == ["Meeting", "Minutes", "Mexico", None]
+
+    completer = appendfilename.SimpleCompleter(vocabulary, vocabulary, 2)
+    assert completer.options == ["Meeting", "Minutes"]
+
+
+@pytest.mark.vocabulary
+@pytest.mark.parametrize("ignore_case", [False, True])
+def test_completion_prefix_search(ignore_case):
+    """check the prefix search against a plain scan of all words"""
+    words = ["Alpha", "alpha", "alphabet", "Beta", "beta", "Gamma", "Ärger",
+             "ärgern", "Straße", "STRASSE", "Zeta", ""]
+    completer = appendfilename.SimpleCompleter(words, ignore_case=ignore_case)
+
+    for text in ["", "a", "A", "al", "alpha", "B", "ä", "Ä", "stra", "x",
+                 "Zeta", "Zetas"]:
+        if ignore_case:
+            expected = [word for word in words
+                        if word and word.casefold().startswith(text.casefold())]
+        else:
+            expected = [word for word in words if word and word.startswith(text)]
+        assert sorted(completer.find_matches(text)) == sorted(expected)
+
+
+@pytest.mark.batch
+def test_journal_resume_and_undo(tmp_path):
+    """check --resume after a crash and --undo of the journal
+
+    The crashed run renamed "a.txt" completely, renamed "b.txt" without
+    recording it as done and did not get to "c.txt" at all."""
+
+    journal = str(tmp_path / "journal")
+    for name in ["a book.txt", "b book.txt", "c.txt"]:
+        (tmp_path / name).write_text("This is a place holder.\n")
+    with appendfilename.Journal(journal) as crashed:
+        for name in ["a", "b", "c"]:
+            crashed.plan(str(tmp_path / f"{name}.txt"),
+                         str(tmp_path / f"{name} book.txt"))
+        crashed.done(str(tmp_path / "a.txt"), str(tmp_path / "a book.txt"))
+    with open(journal, mode="a", encoding="utf-8") as crashed:
+        crashed.write('{"op": "done", "old": "')
+
+    appendfilename.main([str(tmp_path / f"{name}.txt") for name in "abc"] +
+                        ["-t", "book", "--journal", journal, "--resume"])
+    assert sorted(os.listdir(tmp_path)) == [
+        "a book.txt", "b book.txt", "c book.txt", "journal"]
+
+    appendfilename.main(["--undo", journal])
+    assert sorted(os.listdir(tmp_path)) == ["a.txt", "b.txt", "c.txt",
+                                            "journal"]
+    with appendfilename.Journal(journal) as undone:
+        assert undone.recover() == set()
+
+
+@pytest.mark.batch
+def test_journal_resume_with_new_names(tmp_path):
+    """check --resume skips files listed again by their new names"""
+    journal = str(tmp_path / "journal")
+    (tmp_path / "a.txt").write_text("This is a place holder.\n")
+    run_appendfilename([str(tmp_path / "a.txt"), "-t", "book", "--journal", journal])
+    (tmp_path / "b.txt").write_text("This is a place holder.\n")
+
+    # like a glob expanded again for the retry:
+    run_appendfilename([str(tmp_path / name) for name in ["a book.txt", "b.txt"]] +
+                       ["-t", "book", "--journal", journal, "--resume"])
+    assert sorted(os.listdir(tmp_path)) == ["a book.txt", "b book.txt", "journal"]
+
+
+@pytest.mark.batch
+@pytest.mark.skipif(not hasattr(__import__("socket"), "AF_UNIX"),
+                    reason="Unix domain sockets are not available")
+def test_serve_and_connect(tmp_path, monkeypatch):
+    """check --connect against a server which replaced a stale socket"""
+    import socket
+    import tempfile
+    import threading
+
+    # the path of a socket is limited to about 104 bytes (macOS), so it is not in tmp_path:
+    socketdir = tempfile.mkdtemp(dir="/tmp" if os.path.isdir("/tmp") else None)
+    path = os.path.join(socketdir, "sock")
+    if len(os.fsencode(path)) >= 104:
+        pytest.skip("the temporary directory is too long for the path of a socket")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+        stale.bind(path)
+    for name in ["Report.txt", "a.txt", "b.txt"]:
+        (tmp_path / name).write_text(name)
+    monkeypatch.chdir(tmp_path)
+
+    service = appendfilename.RenameService(use_index=False)
+    server = threading.Thread(target=service.serve, args=(path,))
+    server.start()
+    try:
+        assert service.ready.wait(10)
+        run_appendfilename(["--connect", path, "-t", "book", "a.txt", "b.txt"])
+        with appendfilename.RenameClient(path) as client:
+            assert client.word_counts()["Report"] == 1
+            with pytest.raises(ValueError):
+                client.call(op="rename", files="a book.txt", text="x")
+    finally:
+        service.stop()
+        server.join(10)
+        shutil.rmtree(socketdir, ignore_errors=True)
+
+    assert sorted(os.listdir(tmp_path)) == ["Report.txt", "a book.txt",
+                                            "b book.txt"]
+
+
+@pytest.mark.batch
+def test_service_keeps_target_names(tmp_path):
+    """check that the service reads a directory again only if it may
+    have been changed since the last request"""
+    for name in ["a.txt", "b.txt", "c.txt", "c book.txt"]:
+        (tmp_path / name).write_text(name)
+    service = appendfilename.RenameService(use_index=False)
+
+    def rename(name):
+        response = service.handle({"op": "rename", "files": [str(tmp_path / name)], "text": "book",
+                                   "on_conflict": appendfilename.CONFLICT_SUFFIX})
+        return os.path.basename(response["results"][0]["new"])
+
+    assert rename("a.txt") == "a book.txt"
+    os.utime(tmp_path, (1000000000, 1000000000))
+    assert rename("b.txt") == "b book.txt"
+    assert service.targets.scanned == 1
+
+    os.rename(tmp_path / "c book.txt", tmp_path / "d.txt")
+    assert rename("c.txt") == "c book.txt"
+    assert service.targets.scanned == 2
+
+
+@pytest.mark.batch
+@pytest.mark.skipif(not hasattr(__import__("socket"), "AF_UNIX"),
+                    reason="Unix domain sockets are not available")
+@pytest.mark.parametrize("option", [["-t", "book"], ["-p"], ["--smart-prepend"], ["--dryrun"],
+                                    ["--jobs", "2"], ["--idempotent"], ["--journal", "journal"]])
+def test_serve_rejects_options_for_a_run(tmp_path, option):
+    """check --serve refuses options which only apply to a single run"""
+    with pytest.raises(SystemExit) as exit_info:
+        appendfilename.main(["--serve", str(tmp_path / "sock")] + option)
+    assert exit_info.value.code == 5
+    assert not (tmp_path / "sock").exists()
+
+
+@pytest.mark.batch
+@pytest.mark.skipif(not hasattr(__import__("socket"), "AF_UNIX"),
+                    reason="Unix domain sockets are not available")
+def test_serve_keeps_other_files(tmp_path):
+    """check --serve refuses to replace a file which is not a socket"""
+    notes = tmp_path / "notes.txt"
+    notes.write_text("precious")
+
+    with pytest.raises(SystemExit) as exit_info:
+        appendfilename.main(["--serve", str(notes)])
+    assert exit_info.value.code == 6
+    assert notes.read_text() == "precious"
+
+
+@pytest.mark.api
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_rename_many(tmp_path, jobs):
+    """check the asyncio interface including renames that depend on each other"""
+    import asyncio
+
+    names = ["a book.txt", "a.txt", "b.txt", "c.txt"]
+    for name in names:
+        (tmp_path / name).write_text(name)
+    (tmp_path / "d").mkdir()
+
+    async def paths():
+        for name in names + ["d"]:
+            await asyncio.sleep(0)
+            yield str(tmp_path / name)
+
+    async def rename():
+        return [result async for result in
+                appendfilename.rename_many(paths(), "book", jobs=jobs)]
+
+    results = asyncio.run(rename())
+    assert sorted((os.path.basename(result["old"]), result["status"]) for result in results) == [
+        ("a book.txt", "renamed"), ("a.txt", "renamed"), ("b.txt", "renamed"),
+        ("c.txt", "renamed"), ("d", "failed")]
+    assert sorted(os.listdir(tmp_path)) == [
+        "a book book.txt", "a book.txt", "b book.txt", "c book.txt", "d"]
+
+
+@pytest.mark.api
+def test_rename_many_reads_directories_in_workers(tmp_path, monkeypatch):
+    """check that the event loop neither reads directories nor waits
+    for the lock while a worker reads one"""
+    import asyncio
+    import threading
+
+    scanning_threads = []
+    scan = appendfilename.TargetNames.scan
+
+    def recording_scan(targets, absolute):
+        scanning_threads.append(threading.current_thread())
+        assert not targets.lock.locked()
+        return scan(targets, absolute)
+
+    monkeypatch.setattr(appendfilename.TargetNames, "scan", recording_scan)
+    for folder in ["x", "y"]:
+        (tmp_path / folder).mkdir()
+        for name in ["a.txt", "b.txt"]:
+            (tmp_path / folder / name).write_text(name)
+
+    async def rename():
+        paths = [str(tmp_path / folder / name) for folder in ["x", "y"] for name in ["a.txt", "b.txt"]]
+        return [result async for result in appendfilename.rename_many(
+            paths, "book", jobs=2, on_conflict=appendfilename.CONFLICT_SUFFIX)]
+
+    assert all(result["status"] == "renamed" for result in asyncio.run(rename()))
+    assert len(scanning_threads) == 2
+    assert threading.main_thread() not in scanning_threads